@@ -0,0 +1,204 @@
+"""Pipeline dati per il training: decodifica UNA volta, poi solo memoria.
+
+Le immagini vengono decodificate e ridimensionate a 224x224 una sola volta e salvate
+in shard uint8 memory-mapped (``shard_0000.npy``, ...) più un indice ``index.json``.
+Le epoche successive leggono direttamente dagli shard: niente più JPEG da decodificare.
+Quando si aggiungono foto nuove vengono decodificate solo quelle (nuovo shard).
+
+Uso nel notebook:
+    from data_pipeline import build_cache, make_datasets
+    build_cache("dataset", "cache_dataset")
+    train_ds, val_ds, class_names = make_datasets("cache_dataset", batch_size=32)
+"""
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image, ImageOps
+
+# ==========================================
+# 1. CONFIGURAZIONE
+# ==========================================
+IMG_SIZE = (224, 224)
+SHARD_SIZE = 1000
+VALIDATION_SPLIT = 0.2
+SEED = 42
+INDEX_FILE = "index.json"
+_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+# ==========================================
+# 2. CACHE SU DISCO (SHARD UINT8)
+# ==========================================
+def list_images(data_dir: str) -> list:
+    # Una sottocartella per classe (come flow_from_directory), percorsi relativi ordinati
+    items = []
+    for class_name in sorted(os.listdir(data_dir)):
+        class_dir = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(_IMAGE_EXTENSIONS) and not name.startswith("."):
+                items.append((os.path.join(class_name, name), class_name))
+    return items
+
+
+def _decode(path: str, size=IMG_SIZE) -> np.ndarray:
+    img = Image.open(path)
+    # JPEG: riduzione nel dominio DCT, la foto viene decodificata già vicina a 224x224
+    if img.format == "JPEG":
+        img.draft("RGB", size)
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return np.asarray(img.resize(size), dtype=np.uint8)
+
+
+def _file_signature(path: str) -> list:
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def _load_index(cache_dir: str, size) -> dict:
+    path = os.path.join(cache_dir, INDEX_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            index = json.load(f)
+        if index.get("size") == list(size):
+            return index
+        print("♻️ Dimensione immagini cambiata: ricostruisco la cache da zero")
+    return {"size": list(size), "shards": [], "items": {}}
+
+
+def build_cache(data_dir: str, cache_dir: str, size=IMG_SIZE, workers: int = None) -> dict:
+    """Decodifica in parallelo solo le immagini nuove o modificate e le aggiunge alla cache."""
+    os.makedirs(cache_dir, exist_ok=True)
+    index = _load_index(cache_dir, size)
+
+    current = {}
+    for rel_path, class_name in list_images(data_dir):
+        current[rel_path] = (class_name, _file_signature(os.path.join(data_dir, rel_path)))
+
+    # Le immagini cancellate o modificate escono dall'indice (i dati vecchi restano nello shard)
+    items = {
+        rel_path: item for rel_path, item in index["items"].items()
+        if rel_path in current and current[rel_path][1] == item["signature"]
+    }
+    todo = [rel_path for rel_path in current if rel_path not in items]
+
+    print(f"🗃️ Cache: {len(items)} immagini già pronte, {len(todo)} da decodificare")
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for start in range(0, len(todo), SHARD_SIZE):
+            chunk = todo[start:start + SHARD_SIZE]
+            shard_name = f"shard_{len(index['shards']):04d}.npy"
+            shard = np.lib.format.open_memmap(
+                os.path.join(cache_dir, shard_name), mode="w+", dtype=np.uint8,
+                shape=(len(chunk), size[1], size[0], 3),
+            )
+            # Pillow rilascia il GIL durante la decodifica: i thread lavorano davvero in parallelo
+            for offset, pixels in enumerate(pool.map(lambda p: _decode(os.path.join(data_dir, p), size), chunk)):
+                shard[offset] = pixels
+            shard.flush()
+            del shard
+
+            for offset, rel_path in enumerate(chunk):
+                class_name, signature = current[rel_path]
+                items[rel_path] = {
+                    "class": class_name, "shard": len(index["shards"]), "offset": offset, "signature": signature,
+                }
+            index["shards"].append(shard_name)
+            print(f"   💾 {shard_name}: {len(chunk)} immagini")
+
+    index["items"] = items
+    index["class_names"] = sorted({item["class"] for item in items.values()})
+    with open(os.path.join(cache_dir, INDEX_FILE), "w") as f:
+        json.dump(index, f)
+    return index
+
+
+# ==========================================
+# 3. SPLIT DETERMINISTICO TRAIN/VALIDATION
+# ==========================================
+def is_validation(rel_path: str, validation_split: float = VALIDATION_SPLIT, seed: int = SEED) -> bool:
+    # Dipende solo dal nome del file: aggiungendo foto nuove le vecchie non cambiano lato
+    digest = hashlib.md5(f"{seed}:{rel_path}".encode()).hexdigest()
+    return int(digest[:8], 16) / 0xFFFFFFFF < validation_split
+
+
+def load_cache(cache_dir: str):
+    with open(os.path.join(cache_dir, INDEX_FILE)) as f:
+        index = json.load(f)
+    shards = [np.load(os.path.join(cache_dir, name), mmap_mode="r") for name in index["shards"]]
+    return index, shards
+
+
+# ==========================================
+# 4. TF.DATA: LETTURA DAGLI SHARD + AUGMENTATION A BATCH
+# ==========================================
+def build_augmentation():
+    import tensorflow as tf
+    # Stesse trasformazioni di ImageDataGenerator (rotazione 30°, shift/zoom 20%, flip),
+    # applicate a tutto il batch insieme. Lo shear non ha un layer equivalente e viene omesso.
+    return tf.keras.Sequential([
+        tf.keras.layers.RandomFlip("horizontal", seed=SEED),
+        tf.keras.layers.RandomRotation(30 / 360, fill_mode="nearest", seed=SEED),
+        tf.keras.layers.RandomTranslation(0.2, 0.2, fill_mode="nearest", seed=SEED),
+        tf.keras.layers.RandomZoom(0.2, fill_mode="nearest", seed=SEED),
+    ], name="augmentation")
+
+
+def make_datasets(cache_dir: str, batch_size: int = 32, validation_split: float = VALIDATION_SPLIT,
+                  seed: int = SEED, augment: bool = True):
+    """Restituisce ``(train_ds, val_ds, class_names)`` pronti per ``model.fit``."""
+    import tensorflow as tf
+
+    index, shards = load_cache(cache_dir)
+    class_names = index["class_names"]
+    class_ids = {name: i for i, name in enumerate(class_names)}
+    size = index["size"]
+
+    # Tabelle (shard, offset, etichetta) per ogni immagine, ordinate per percorso
+    locations = {"train": [], "val": []}
+    for rel_path in sorted(index["items"]):
+        item = index["items"][rel_path]
+        split = "val" if is_validation(rel_path, validation_split, seed) else "train"
+        locations[split].append((item["shard"], item["offset"], class_ids[item["class"]]))
+
+    augmentation = build_augmentation() if augment else None
+
+    def make(split: str, training: bool):
+        table = np.asarray(locations[split], dtype=np.int64).reshape(-1, 3)
+
+        def gather(ids):
+            # Copia dal memmap al batch: nessuna decodifica, solo lettura dalla page cache
+            out = np.empty((len(ids), size[1], size[0], 3), dtype=np.uint8)
+            for j, i in enumerate(ids):
+                shard, offset, _ = table[i]
+                out[j] = shards[shard][offset]
+            return out, table[ids, 2].astype(np.int32)
+
+        def load_batch(ids):
+            images, labels = tf.numpy_function(gather, [ids], [tf.uint8, tf.int32])
+            images.set_shape([None, size[1], size[0], 3])
+            labels.set_shape([None])
+            return images, labels
+
+        def finish(images, labels):
+            images = tf.cast(images, tf.float32)
+            if training and augmentation is not None:
+                images = augmentation(images, training=True)
+            # Stessa normalizzazione di mobilenet_v2.preprocess_input
+            images = images / 127.5 - 1.0
+            return images, tf.one_hot(labels, len(class_names))
+
+        ds = tf.data.Dataset.range(len(table))
+        if training:
+            ds = ds.shuffle(len(table), seed=seed, reshuffle_each_iteration=True)
+        ds = ds.batch(batch_size)
+        ds = ds.map(load_batch, num_parallel_calls=tf.data.AUTOTUNE)
+        ds = ds.map(finish, num_parallel_calls=tf.data.AUTOTUNE)
+        return ds.prefetch(tf.data.AUTOTUNE)
+
+    print(f"📊 Train: {len(locations['train'])} immagini | Validation: {len(locations['val'])} immagini")
+    return make("train", True), make("val", False), class_names
@@ -0,0 +1,167 @@
+"""Cache delle feature di MobileNetV2 congelato: la "testa" si addestra in secondi.
+
+Con la base congelata ogni epoca rifarebbe lo stesso forward pass di MobileNetV2 su
+tutte le foto. Qui l'embedding (output del GlobalAveragePooling2D, 1280 valori) viene
+calcolato UNA volta per immagine e per variante di augmentation (variante 0 = foto
+originale) e salvato in shard float16 con un indice ``features.json``.
+Aggiungendo foto nuove si calcolano solo quelle.
+
+Uso nel notebook (dopo ``build_cache`` di ``data_pipeline``):
+    from feature_cache import build_feature_cache, make_feature_datasets, build_head
+    build_feature_cache("dataset_cache", "feature_cache")
+    train_ds, val_ds, class_names = make_feature_datasets("feature_cache")
+"""
+import os
+import json
+import numpy as np
+from data_pipeline import SEED, VALIDATION_SPLIT, build_augmentation, is_validation, load_cache
+
+# ==========================================
+# 1. CONFIGURAZIONE
+# ==========================================
+FEATURE_VARIANTS = 5          # 1 originale + 4 versioni aumentate per immagine
+FEATURE_SHARD_SIZE = 1000
+EXTRACT_BATCH_SIZE = 64
+BACKBONE = "mobilenet_v2_imagenet_avg"
+FEATURES_INDEX = "features.json"
+
+
+# ==========================================
+# 2. ESTRAZIONE INCREMENTALE DELLE FEATURE
+# ==========================================
+def _load_feature_index(feature_dir: str, config: dict) -> dict:
+    path = os.path.join(feature_dir, FEATURES_INDEX)
+    if os.path.exists(path):
+        with open(path) as f:
+            index = json.load(f)
+        if index.get("config") == config:
+            return index
+        print("♻️ Configurazione feature cambiata: ricalcolo la cache da zero")
+    return {"config": config, "shards": [], "items": {}}
+
+
+def build_feature_cache(image_cache_dir: str, feature_dir: str, variants: int = FEATURE_VARIANTS,
+                        batch_size: int = EXTRACT_BATCH_SIZE) -> dict:
+    """Calcola gli embedding delle immagini nuove o modificate nella cache di ``data_pipeline``."""
+    os.makedirs(feature_dir, exist_ok=True)
+    images_index, image_shards = load_cache(image_cache_dir)
+    size = images_index["size"]
+    config = {"backbone": BACKBONE, "size": size, "variants": variants, "seed": SEED}
+    index = _load_feature_index(feature_dir, config)
+
+    # Valida solo se la foto sorgente è identica (stessa firma dimensione/mtime)
+    items = {
+        rel_path: item for rel_path, item in index["items"].items()
+        if rel_path in images_index["items"] and images_index["items"][rel_path]["signature"] == item["signature"]
+    }
+    todo = [rel_path for rel_path in sorted(images_index["items"]) if rel_path not in items]
+    print(f"🧮 Feature: {len(items)} immagini già pronte, {len(todo)} da calcolare ({variants} varianti)")
+
+    if todo:
+        import tensorflow as tf
+
+        # MobileNetV2 senza testa con pooling="avg" == base_model + GlobalAveragePooling2D
+        backbone = tf.keras.applications.MobileNetV2(
+            weights="imagenet", include_top=False, pooling="avg", input_shape=(size[1], size[0], 3)
+        )
+        backbone.trainable = False
+        augmentation = build_augmentation()
+        tf.random.set_seed(SEED)
+
+        @tf.function
+        def embed(pixels, augment):
+            images = tf.cast(pixels, tf.float32)
+            if augment:
+                images = augmentation(images, training=True)
+            return backbone(images / 127.5 - 1.0, training=False)
+
+        for start in range(0, len(todo), FEATURE_SHARD_SIZE):
+            chunk = todo[start:start + FEATURE_SHARD_SIZE]
+            shard_name = f"features_{len(index['shards']):04d}.npy"
+            shard = np.lib.format.open_memmap(
+                os.path.join(feature_dir, shard_name), mode="w+", dtype=np.float16,
+                shape=(len(chunk), variants, backbone.output_shape[-1]),
+            )
+            for b in range(0, len(chunk), batch_size):
+                names = chunk[b:b + batch_size]
+                pixels = np.stack([
+                    image_shards[images_index["items"][p]["shard"]][images_index["items"][p]["offset"]] for p in names
+                ])
+                for v in range(variants):
+                    shard[b:b + len(names), v] = embed(pixels, v > 0).numpy().astype(np.float16)
+            shard.flush()
+            del shard
+
+            for offset, rel_path in enumerate(chunk):
+                source = images_index["items"][rel_path]
+                items[rel_path] = {
+                    "class": source["class"], "shard": len(index["shards"]), "offset": offset,
+                    "signature": source["signature"],
+                }
+            index["shards"].append(shard_name)
+            print(f"   💾 {shard_name}: {len(chunk)} immagini")
+
+    index["items"] = items
+    with open(os.path.join(feature_dir, FEATURES_INDEX), "w") as f:
+        json.dump(index, f)
+    return index
+
+
+# ==========================================
+# 3. DATASET E TESTA DI CLASSIFICAZIONE
+# ==========================================
+def make_feature_datasets(feature_dir: str, batch_size: int = 32, validation_split: float = VALIDATION_SPLIT,
+                          seed: int = SEED, class_map: dict = None):
+    """Restituisce ``(train_ds, val_ds, class_names)`` di embedding pronti per ``build_head``.
+
+    ``class_map`` rinomina/accorpa le cartelle (es. ``{"trash": "plastic"}``) senza
+    ricalcolare nulla: le etichette vengono assegnate solo qui.
+    """
+    import tensorflow as tf
+
+    with open(os.path.join(feature_dir, FEATURES_INDEX)) as f:
+        index = json.load(f)
+    shards = [np.load(os.path.join(feature_dir, name), mmap_mode="r") for name in index["shards"]]
+    class_map = class_map or {}
+    names = sorted(index["items"])
+    classes = [class_map.get(index["items"][p]["class"], index["items"][p]["class"]) for p in names]
+    class_names = sorted(set(classes))
+    class_ids = {name: i for i, name in enumerate(class_names)}
+
+    # Le feature sono piccole (qualche decina di MB): si tengono tutte in RAM
+    features = {"train": [], "val": []}
+    labels = {"train": [], "val": []}
+    for rel_path, class_name in zip(names, classes):
+        item = index["items"][rel_path]
+        split = "val" if is_validation(rel_path, validation_split, seed) else "train"
+        features[split].append(shards[item["shard"]][item["offset"]])
+        labels[split].append(class_ids[class_name])
+
+    variants = index["config"]["variants"]
+    dim = shards[0].shape[-1] if shards else 0
+
+    def make(split: str, training: bool):
+        x = np.asarray(features[split], dtype=np.float32).reshape(-1, variants, dim)
+        y = tf.one_hot(np.asarray(labels[split], dtype=np.int32), len(class_names))
+        ds = tf.data.Dataset.from_tensor_slices((x, y))
+        if training:
+            # Ogni epoca pesca a caso una delle varianti aumentate di ciascuna foto
+            ds = ds.shuffle(len(x), seed=seed, reshuffle_each_iteration=True)
+            ds = ds.map(lambda f, l: (f[tf.random.uniform([], 0, variants, dtype=tf.int32)], l),
+                        num_parallel_calls=tf.data.AUTOTUNE)
+        else:
+            ds = ds.map(lambda f, l: (f[0], l))
+        return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+    print(f"📊 Train: {len(labels['train'])} embedding | Validation: {len(labels['val'])} embedding")
+    return make("train", True), make("val", False), class_names
+
+
+def build_head(num_classes: int, dim: int = 1280, dropout: float = 0.4):
+    import tensorflow as tf
+    # Stessa testa del modello completo (GAP già incluso nell'embedding): Dropout -> Dense
+    return tf.keras.Sequential([
+        tf.keras.Input(shape=(dim,)),
+        tf.keras.layers.Dropout(dropout),
+        tf.keras.layers.Dense(num_classes, activation="softmax"),
+    ], name="head")
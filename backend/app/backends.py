@@ -0,0 +1,402 @@
+import os
+import json
+import glob
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: niente lock tra processi (un solo processo in sviluppo)
+    fcntl = None
+
+# ==========================================
+# 1. CONFIGURAZIONE BACKEND
+# ==========================================
+# keras       -> Model.predict() (comportamento storico)
+# tf_function -> chiamata diretta del grafo tracciato con tf.function
+# tflite_fp16 -> interprete TFLite con pesi float16
+# tflite_int8 -> interprete TFLite quantizzato int8 (calibrato su trashnet)
+# saved_model -> SavedModel con il grafo già tracciato (avvio a freddo più rapido)
+BACKENDS = ("keras", "tf_function", "tflite_fp16", "tflite_int8", "saved_model")
+
+DATASET_DIR = os.environ.get("TRASHNET_DIR", "../ai/data/trashnet")
+
+# Soglie di parità rispetto al modello Keras: sotto/sopra queste il backend NON si attiva
+PARITY_MIN_AGREEMENT = float(os.environ.get("PARITY_MIN_AGREEMENT", "0.98"))
+PARITY_MAX_DRIFT = float(os.environ.get("PARITY_MAX_DRIFT", "0.05"))
+PARITY_SAMPLES = int(os.environ.get("PARITY_SAMPLES", "300"))
+PARITY_BATCH_SIZE = 32
+CALIBRATION_SAMPLES = int(os.environ.get("CALIBRATION_SAMPLES", "200"))
+# Versione del formato dei report: i report (e i file convertiti) più vecchi vengono rifatti.
+# 2 = calibrazione e parità sugli input normalizzati come nel server
+# 3 = parità int8 su immagini diverse da quelle di calibrazione
+PARITY_REPORT_VERSION = 3
+
+_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+class ParityError(RuntimeError):
+    """Il backend si discosta troppo dal modello Keras di riferimento."""
+
+
+def _tf():
+    # Import pigro: TensorFlow richiede diversi secondi, lo carichiamo solo quando serve
+    import tensorflow as tf
+    return tf
+
+
+# ==========================================
+# 2. BACKEND DISPONIBILI
+# ==========================================
+class KerasBackend:
+    name = "keras"
+
+    def __init__(self, keras_model):
+        self._model = keras_model
+
+    def predict(self, img_batch: np.ndarray) -> np.ndarray:
+        return self._model.predict(img_batch, verbose=0)
+
+
+class TFFunctionBackend:
+    name = "tf_function"
+
+    def __init__(self, keras_model):
+        self._fn = serving_function(keras_model)
+
+    def predict(self, img_batch: np.ndarray) -> np.ndarray:
+        return self._fn(img_batch).numpy()
+
+
+def serving_function(keras_model):
+    # Saltiamo tutta la macchina di Model.predict(): un solo grafo tracciato per batch di qualsiasi dimensione
+    tf = _tf()
+    signature = [tf.TensorSpec([None, *keras_model.input_shape[1:]], tf.float32)]
+    return tf.function(lambda x: keras_model(x, training=False), input_signature=signature)
+
+
+class SavedModelBackend:
+    name = "saved_model"
+
+    def __init__(self, path: str):
+        # Niente ricostruzione dei layer Keras né tracing: il grafo è già nel SavedModel
+        self._loaded = _tf().saved_model.load(path)
+        self._fn = self._loaded.signatures["serving_default"]
+
+    def predict(self, img_batch: np.ndarray) -> np.ndarray:
+        outputs = self._fn(_tf().constant(img_batch, dtype="float32"))
+        return next(iter(outputs.values())).numpy()
+
+
+def _tflite_interpreter_class():
+    # Se presente usiamo tflite-runtime (pochi MB) al posto di tutto TensorFlow
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        Interpreter = _tf().lite.Interpreter
+    return Interpreter
+
+
+class TFLiteBackend:
+    def __init__(self, name: str, tflite_path: str):
+        self.name = name
+        self.path = tflite_path
+        Interpreter = _tflite_interpreter_class()
+        self._interpreter = Interpreter(model_path=tflite_path, num_threads=os.cpu_count())
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = None
+        # L'interprete non è thread-safe
+        self._lock = threading.Lock()
+
+    def predict(self, img_batch: np.ndarray) -> np.ndarray:
+        img_batch = self._quantize(img_batch)
+        with self._lock:
+            if self._batch_size != len(img_batch):
+                self._interpreter.resize_tensor_input(self._input["index"], img_batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = len(img_batch)
+            self._interpreter.set_tensor(self._input["index"], img_batch)
+            self._interpreter.invoke()
+            out = self._interpreter.get_tensor(self._output["index"]).copy()
+        return self._dequantize(out)
+
+    def _quantize(self, img_batch):
+        dtype = self._input["dtype"]
+        if dtype == np.float32:
+            return np.ascontiguousarray(img_batch, dtype=np.float32)
+        scale, zero_point = self._input["quantization"]
+        info = np.iinfo(dtype)
+        q = np.round(img_batch / scale + zero_point)
+        return np.clip(q, info.min, info.max).astype(dtype)
+
+    def _dequantize(self, out):
+        if out.dtype == np.float32:
+            return out
+        scale, zero_point = self._output["quantization"]
+        return (out.astype(np.float32) - zero_point) * scale
+
+
+# ==========================================
+# 3. CONVERSIONE TFLITE
+# ==========================================
+def tflite_path_for(model_path: str, name: str) -> str:
+    return f"{os.path.splitext(model_path)[0]}_{name.split('_', 1)[1]}.tflite"
+
+
+def saved_model_path_for(model_path: str) -> str:
+    return f"{os.path.splitext(model_path)[0]}_savedmodel"
+
+
+def parity_path_for(model_path: str, name: str) -> str:
+    return f"{os.path.splitext(model_path)[0]}_{name}.parity.json"
+
+
+def lock_path_for(model_path: str, name: str) -> str:
+    return f"{os.path.splitext(model_path)[0]}_{name}.lock"
+
+
+@contextmanager
+def _artifacts_lock(model_path: str, name: str):
+    # Con più worker un solo processo alla volta converte e verifica lo stesso backend:
+    # gli altri aspettano e poi trovano file convertito e report già pronti
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path_for(model_path, name), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write_json_atomic(path: str, data: dict):
+    # File temporaneo + os.replace: chi legge vede il report vecchio o quello nuovo, mai a metà
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def model_fingerprint(model_path: str) -> str:
+    # Hash del file: cambia ogni volta che il modello viene riaddestrato
+    h = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def export_saved_model(keras_model, out_path: str):
+    tf = _tf()
+    fn = serving_function(keras_model)
+    tmp_path = f"{out_path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tf.saved_model.save(keras_model, tmp_path, signatures=fn.get_concrete_function())
+    shutil.rmtree(out_path, ignore_errors=True)
+    os.replace(tmp_path, out_path)
+    logging.info(f"💾 SavedModel pre-tracciato salvato in {out_path}")
+
+
+def convert_to_tflite(keras_model, out_path: str, quantization: str, calibration_batches=None):
+    tf = _tf()
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if calibration_batches is None:
+            raise ValueError("La quantizzazione int8 richiede immagini di calibrazione")
+
+        def representative_dataset():
+            for batch in calibration_batches():
+                for img in batch:
+                    yield [img[np.newaxis].astype(np.float32)]
+
+        converter.representative_dataset = representative_dataset
+        # Tutti gli operatori in int8; input/output restano float32 per non
+        # cambiare il preprocessing lato server
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    else:
+        raise ValueError(f"Quantizzazione sconosciuta: {quantization}")
+
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(converter.convert())
+    os.replace(tmp_path, out_path)
+    logging.info(f"💾 Modello TFLite ({quantization}) salvato in {out_path}")
+
+
+# ==========================================
+# 4. DATASET E REPORT DI PARITÀ
+# ==========================================
+def dataset_images(dataset_dir: str = DATASET_DIR, limit: int = None) -> list:
+    # Campione deterministico e bilanciato: prendiamo a turno da ogni classe
+    per_class = [
+        sorted(p for p in glob.glob(os.path.join(class_dir, "*")) if p.lower().endswith(_IMAGE_EXTENSIONS))
+        for class_dir in sorted(glob.glob(os.path.join(dataset_dir, "*")))
+        if os.path.isdir(class_dir)
+    ]
+    paths = []
+    for i in range(max((len(c) for c in per_class), default=0)):
+        for c in per_class:
+            if i < len(c):
+                paths.append(c[i])
+    return paths[:limit] if limit else paths
+
+
+def calibration_images(dataset_dir: str = DATASET_DIR) -> list:
+    return dataset_images(dataset_dir, limit=CALIBRATION_SAMPLES)
+
+
+def parity_images(name: str, dataset_dir: str = DATASET_DIR) -> list:
+    # Per int8 la parità si misura su immagini NON usate per la calibrazione,
+    # altrimenti l'accordo risulterebbe migliore di quello reale
+    start = CALIBRATION_SAMPLES if name == "tflite_int8" else 0
+    return dataset_images(dataset_dir)[start:start + PARITY_SAMPLES]
+
+
+def iter_dataset_batches(paths, preprocess, batch_size: int = PARITY_BATCH_SIZE):
+    for start in range(0, len(paths), batch_size):
+        batch = []
+        for path in paths[start:start + batch_size]:
+            with open(path, "rb") as f:
+                batch.append(preprocess(f.read()))
+        yield np.stack(batch)
+
+
+def parity_report(candidate, reference, batches) -> dict:
+    agree = 0
+    total = 0
+    drifts = []
+    for batch in batches:
+        ref = np.asarray(reference.predict(batch))
+        cand = np.asarray(candidate.predict(batch))
+        ref_top = np.argmax(ref, axis=1)
+        agree += int(np.sum(ref_top == np.argmax(cand, axis=1)))
+        total += len(batch)
+        # Drift = differenza di confidenza sulla classe scelta dal modello Keras
+        rows = np.arange(len(batch))
+        drifts.append(np.abs(cand[rows, ref_top] - ref[rows, ref_top]))
+
+    if total == 0:
+        raise ParityError("Nessuna immagine disponibile per il controllo di parità")
+
+    drifts = np.concatenate(drifts)
+    agreement = agree / total
+    mean_drift = float(np.mean(drifts))
+    return {
+        "backend": candidate.name,
+        "samples": total,
+        "top1_agreement": round(agreement, 4),
+        "mean_confidence_drift": round(mean_drift, 4),
+        "max_confidence_drift": round(float(np.max(drifts)), 4),
+        "min_agreement": PARITY_MIN_AGREEMENT,
+        "max_drift": PARITY_MAX_DRIFT,
+        "passed": agreement >= PARITY_MIN_AGREEMENT and mean_drift <= PARITY_MAX_DRIFT,
+    }
+
+
+def _load_report(path: str, fingerprint: str):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if report.get("model_fingerprint") != fingerprint or report.get("version") != PARITY_REPORT_VERSION:
+        return None
+    return report
+
+
+# ==========================================
+# 5. CREAZIONE BACKEND (CON GATE DI PARITÀ)
+# ==========================================
+def create_backend(name: str, model_path: str, load_keras, preprocess):
+    """Restituisce il backend richiesto, oppure solleva ``ParityError``.
+
+    ``load_keras`` viene chiamato solo se serve davvero il modello Keras
+    (backend keras/tf_function, conversione/esportazione o nuovo report di parità).
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Backend sconosciuto: {name} (disponibili: {', '.join(BACKENDS)})")
+
+    if name == "keras":
+        return KerasBackend(load_keras())
+
+    fingerprint = model_fingerprint(model_path)
+    report_path = parity_path_for(model_path, name)
+
+    with _artifacts_lock(model_path, name):
+        report = _load_report(report_path, fingerprint)
+
+        if name == "tf_function":
+            backend = TFFunctionBackend(load_keras())
+        elif name == "saved_model":
+            saved_path = saved_model_path_for(model_path)
+            if report is None or not os.path.isdir(saved_path):
+                export_saved_model(load_keras(), saved_path)
+                report = None
+            backend = SavedModelBackend(saved_path)
+        else:
+            tflite_path = tflite_path_for(model_path, name)
+            if report is None or not os.path.exists(tflite_path):
+                # Modello cambiato (o mai convertito): rigeneriamo il file TFLite
+                quantization = "float16" if name == "tflite_fp16" else "int8"
+                calibration = lambda: iter_dataset_batches(
+                    calibration_images(), preprocess
+                )
+                convert_to_tflite(load_keras(), tflite_path, quantization, calibration)
+                report = None
+            backend = TFLiteBackend(name, tflite_path)
+
+        if report is None:
+            paths = parity_images(name)
+            report = parity_report(backend, KerasBackend(load_keras()), iter_dataset_batches(paths, preprocess))
+            report["model_fingerprint"] = fingerprint
+            report["version"] = PARITY_REPORT_VERSION
+            _write_json_atomic(report_path, report)
+            logging.info(f"📋 Report di parità salvato in {report_path}")
+
+    logging.info(
+        f"📋 Parità {name}: top-1 {report['top1_agreement']:.2%} | "
+        f"drift medio {report['mean_confidence_drift']:.4f} | campioni {report['samples']}"
+    )
+    if not report["passed"]:
+        raise ParityError(
+            f"Backend {name} rifiutato: accordo top-1 {report['top1_agreement']:.2%} "
+            f"(min {PARITY_MIN_AGREEMENT:.2%}), drift medio {report['mean_confidence_drift']:.4f} "
+            f"(max {PARITY_MAX_DRIFT})"
+        )
+    return backend
+
+
+if __name__ == "__main__":
+    # Uso: python -m app.backends tflite_int8
+    # Converte il modello e genera il report di parità senza avviare il server
+    import sys
+    from . import model_loader
+    from .preprocessing import preprocess
+
+    for backend_name in sys.argv[1:] or BACKENDS[1:]:
+        try:
+            create_backend(
+                backend_name,
+                model_loader.MODEL_PATH,
+                model_loader.load_keras_model,
+                preprocess,
+            )
+            print(f"✅ {backend_name}: parità OK")
+        except ParityError as e:
+            print(f"❌ {e}")
+        report_path = parity_path_for(model_loader.MODEL_PATH, backend_name)
+        if os.path.exists(report_path):
+            with open(report_path) as f:
+                print(f.read())
@@ -0,0 +1,118 @@
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+
+
+# ==========================================
+# 1. CHIAVI DELLA CACHE
+# ==========================================
+def content_key(image_bytes: bytes) -> str:
+    # Stessi byte caricati -> stessa chiave
+    return "sha256:" + hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_key(pixels: np.ndarray) -> str:
+    # dHash a 64 bit: confronta la luminosità di pixel adiacenti su una miniatura 9x8.
+    # Nella maggior parte dei casi resta uguale se la stessa foto viene ricompressa o ridimensionata
+    small = np.asarray(Image.fromarray(pixels).convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return "dhash:" + f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+
+def _entry_size(key: str, value: dict) -> int:
+    # Stima (per difetto) della memoria occupata da una voce
+    return sys.getsizeof(key) + sys.getsizeof(value) + sum(
+        sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items()
+    )
+
+
+# ==========================================
+# 2. CACHE LRU + TTL
+# ==========================================
+class PredictionCache:
+    """Cache delle predizioni, limitata per numero di voci, memoria e durata (TTL).
+
+    Viene svuotata ogni volta che cambia la versione del modello caricato.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self.model_version = None
+        self._entries = OrderedDict()  # chiave -> (scadenza, risultato, dimensione)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ("hits", "misses", "content_hits", "perceptual_hits", "evictions", "expirations", "invalidations"), 0
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def set_model_version(self, version: str):
+        with self._lock:
+            if version != self.model_version:
+                if self._entries:
+                    self._counters["invalidations"] += 1
+                self._entries.clear()
+                self._bytes = 0
+                self.model_version = version
+
+    def get(self, key: str, kind: str = "content"):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                self._counters["expirations"] += 1
+                entry = None
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            self._counters[f"{kind}_hits"] += 1
+            return dict(entry[1])
+
+    def record_miss(self):
+        with self._lock:
+            self._counters["misses"] += 1
+
+    def put(self, keys, result: dict):
+        if not self.enabled:
+            return
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+                size = _entry_size(key, result)
+                if size > self.max_bytes:
+                    continue
+                self._entries[key] = (expires, dict(result), size)
+                self._bytes += size
+            # Eviction LRU finché non rientriamo nei limiti
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "model_version": self.model_version,
+            }
@@ -0,0 +1,69 @@
+import os
+import asyncio
+from collections import deque
+import numpy as np
+from . import metrics
+
+# ==========================================
+# 1. CONFIGURAZIONE STREAM LIVE (/ws/live)
+# ==========================================
+# Media delle probabilità sugli ultimi N fotogrammi elaborati
+LIVE_SMOOTHING_WINDOW = int(os.environ.get("LIVE_SMOOTHING_WINDOW", "5"))
+# Sotto questa confidenza (mediata) la classe stabile non cambia
+LIVE_MIN_CONFIDENCE = float(os.environ.get("LIVE_MIN_CONFIDENCE", "0.5"))
+# Fotogrammi più grandi vengono scartati (la camera deve inviare JPEG piccoli)
+LIVE_MAX_FRAME_KB = float(os.environ.get("LIVE_MAX_FRAME_KB", "512"))
+
+
+# ==========================================
+# 2. ULTIMO FOTOGRAMMA (FRAME SKIPPING)
+# ==========================================
+class LatestFrame:
+    """Slot da un solo fotogramma: se l'inferenza è indietro, il nuovo sostituisce quello in attesa."""
+
+    def __init__(self):
+        self._frame = None
+        self._event = asyncio.Event()
+        self._closed = False
+
+    def put(self, frame: bytes):
+        if self._frame is not None:
+            metrics.LIVE_FRAMES.inc("dropped")
+        self._frame = frame
+        self._event.set()
+
+    def close(self):
+        self._closed = True
+        self._event.set()
+
+    async def get(self):
+        # Restituisce il fotogramma più recente, oppure None a connessione chiusa
+        while self._frame is None:
+            if self._closed:
+                return None
+            self._event.clear()
+            await self._event.wait()
+        frame, self._frame = self._frame, None
+        return frame
+
+
+# ==========================================
+# 3. MEDIA TEMPORALE E CLASSE STABILE
+# ==========================================
+class ProbabilitySmoother:
+    """Media mobile delle probabilità: segnala solo quando cambia la classe stabile."""
+
+    def __init__(self, window: int = LIVE_SMOOTHING_WINDOW, min_confidence: float = LIVE_MIN_CONFIDENCE):
+        self._frames = deque(maxlen=max(1, window))
+        self.min_confidence = min_confidence
+        self.stable_index = None
+        self.smoothed = None
+
+    def update(self, probs: np.ndarray) -> bool:
+        self._frames.append(np.asarray(probs, dtype=np.float32))
+        self.smoothed = np.mean(self._frames, axis=0)
+        index = int(np.argmax(self.smoothed))
+        if index == self.stable_index or self.smoothed[index] < self.min_confidence:
+            return False
+        self.stable_index = index
+        return True
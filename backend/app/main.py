@@ -1,14 +1,34 @@
+import os
 import sys
+import json
 import time # <--- 1. AGGIUNTO IMPORT TIME
-from fastapi.responses import JSONResponse 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import zlib
+import asyncio
+import zipfile
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Literal
-from .model_loader import load_model, predict as predict_image_model
+from typing import List, Literal
+from . import metrics
+from .live import LIVE_MAX_FRAME_KB, LatestFrame, ProbabilitySmoother
+from .model_loader import (
+    WARMING_UP_MSG, NOT_LOADED_MSG, start_background_loading, unload_model, model_status, is_model_ready,
+    is_model_loading, cache_stats, worker_stats, start_scheduler, stop_scheduler, predict_probs_async,
+    result_from_probs, predict_async as predict_image_model
+)
 
 app = FastAPI(title="SmartTrash AI Backend")
 
+VALID_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+FORMAT_ERROR_MSG = "Errore! Ricarica la pagina e invia una foto in .jpg o .png"
+ARCHIVE_ERROR_MSG = "Archivio non valido: il file .zip è danneggiato o non è uno zip"
+
+# /predict/batch: quante immagini tenere "in volo" al massimo (limita la memoria)
+# e dimensione massima di un singolo file estratto da uno zip
+BATCH_ENDPOINT_WINDOW = int(os.environ.get("BATCH_ENDPOINT_WINDOW", "32"))
+BATCH_MAX_FILE_MB = float(os.environ.get("BATCH_MAX_FILE_MB", "20"))
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -17,6 +37,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def error_content(error: str, material: str = "Errore", tip: str = None) -> dict:
+    # Stessa forma per tutte le risposte di errore (il frontend legge material e tip)
+    return {
+        "error": error,
+        "material": material,
+        "bin": "N/A",
+        "tip": tip if tip is not None else error,
+        "color": "red",
+        "confidence": 0.0
+    }
+
 class PredictResponse(BaseModel):
     material: str
     bin: str
@@ -26,7 +57,17 @@ class PredictResponse(BaseModel):
 
 @app.on_event("startup")
 def startup_event():
-    load_model()
+    # Non blocchiamo l'avvio: il server accetta subito connessioni mentre
+    # il modello viene caricato e scaldato in background (vedi /ready)
+    start_scheduler()
+    start_background_loading()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # Prima il pool: risveglia i thread dello scheduler in attesa di un worker,
+    # altrimenti stop_scheduler() resterebbe bloccato ad aspettarli
+    unload_model()
+    stop_scheduler()
 
 # ==========================================
 # ☕ KEEP-ALIVE ENDPOINT (AGGIUNTO QUI)
@@ -37,12 +78,42 @@ def health_check():
     return {"status": "active", "message": "SmartTrash AI è sveglio!"}
 # ==========================================
 
+# Readiness: 200 solo quando il modello è caricato e scaldato, altrimenti 503 con l'avanzamento
+@app.get("/ready")
+def ready_endpoint():
+    return JSONResponse(status_code=200 if is_model_ready() else 503, content=model_status())
+
+# Contatori hit/miss della cache delle predizioni
+@app.get("/cache/stats")
+def cache_stats_endpoint():
+    return cache_stats()
+
+# Metriche in formato Prometheus: istogrammi per fase, contatori per classe/errore/formato
+@app.get("/metrics")
+def metrics_endpoint():
+    stats = cache_stats()
+    gauges = {
+        "smarttrash_cache_hits": stats["hits"],
+        "smarttrash_cache_misses": stats["misses"],
+        "smarttrash_cache_entries": stats["entries"],
+        "smarttrash_model_ready": int(is_model_ready()),
+    }
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+# Stato dei processi di inferenza (vuoto se il modello gira nel processo HTTP)
+@app.get("/workers")
+def workers_endpoint():
+    return worker_stats()
+
 @app.post("/predict") 
 async def predict_endpoint(file: UploadFile = File(...)):
     
-    # ⏱️ START CRONOMETRO TOTALE
-    start_time = time.time()
-    print(f"\n➡️ RICHIESTA RICEVUTA! File: {file.filename}", file=sys.stderr, flush=True)
+    # ⏱️ START CRONOMETRO TOTALE (i tempi finiscono negli istogrammi di /metrics)
+    start_time = time.perf_counter()
+    # Log dettagliato solo per una frazione delle richieste (LOG_SAMPLE_RATE)
+    verbose = metrics.sample_log()
+    if verbose:
+        print(f"\n➡️ RICHIESTA RICEVUTA! File: {file.filename}", file=sys.stderr, flush=True)
 
     # ==========================================
     # 1. LEGGIAMO PRIMA IL FILE (CRUCIALE!)
@@ -51,65 +122,57 @@ async def predict_endpoint(file: UploadFile = File(...)):
     # interpreterà il rifiuto immediato come un crash di rete.
     try:
         # ⏱️ MISURAZIONE UPLOAD
-        t0 = time.time()
+        t0 = time.perf_counter()
         
         img_bytes = await file.read()
         
-        t1 = time.time()
-        upload_time = t1 - t0
-        size_mb = len(img_bytes) / (1024 * 1024)
+        upload_time = time.perf_counter() - t0
+        metrics.UPLOAD_READ.observe(upload_time)
         
-        # STAMPA TEMPO UPLOAD
-        print(f"📡 [UPLOAD] Tempo lettura: {upload_time:.2f}s | Dimensione: {size_mb:.2f} MB", file=sys.stderr, flush=True)
+        if verbose:
+            size_mb = len(img_bytes) / (1024 * 1024)
+            print(f"📡 [UPLOAD] Tempo lettura: {upload_time:.2f}s | Dimensione: {size_mb:.2f} MB", file=sys.stderr, flush=True)
 
     except Exception as e:
-         return JSONResponse(status_code=200, content={
-             "error": "Errore upload", 
-             "tip": "Riprova", 
-             "material": "Errore", 
-             "bin": "N/A", 
-             "color": "red", 
-             "confidence": 0.0
-         })
+         metrics.ERRORS.inc("upload")
+         return JSONResponse(status_code=200, content=error_content("Errore upload", tip="Riprova"))
 
     # ==========================================
     # 2. ORA FACCIAMO LA VALIDAZIONE
     # ==========================================
     filename = file.filename.lower()
-    valid_extensions = ('.jpg', '.jpeg', '.png')
     
-    if not filename.endswith(valid_extensions):
-        msg = "Errore! Ricarica la pagina e invia una foto in .jpg o .png"
-        print(f"❌ FILE RIFIUTATO: {filename}", file=sys.stderr)
+    if not filename.endswith(VALID_EXTENSIONS):
+        # Rifiuto causato dal client: contato in /metrics, stampato solo se campionato
+        if verbose:
+            print(f"❌ FILE RIFIUTATO: {filename}", file=sys.stderr, flush=True)
+        metrics.ERRORS.inc("format")
+        metrics.REJECTED_FORMATS.inc(metrics.extension_label(filename))
         
+        return JSONResponse(status_code=200, content=error_content(FORMAT_ERROR_MSG, "Formato Errato"))
+    # ==========================================
+
+    # Modello ancora in avvio: risposta immediata ed esplicita, senza decodificare nulla
+    if not is_model_ready() and is_model_loading():
+        metrics.ERRORS.inc("warming_up")
         return JSONResponse(
-            status_code=200, 
-            content={
-                "error": msg,            
-                "material": "Formato Errato", 
-                "bin": "N/A",
-                "tip": msg,              
-                "color": "red",          
-                "confidence": 0.0
-            }
+            status_code=200,
+            content={**error_content(WARMING_UP_MSG, "Avvio in corso"), "warming_up": True},
+            headers={"Retry-After": "5"},
         )
-    # ==========================================
 
     try:
-        # ⏱️ MISURAZIONE AI
-        t2 = time.time()
-        print("🧠 [AI] Inizio elaborazione modello...", file=sys.stderr, flush=True)
-
         # Passiamo i byte che ABBIAMO GIÀ LETTO (img_bytes)
         # Non usare più 'await file.read()' qui sotto perché l'abbiamo già fatto sopra!
-        result = predict_image_model(img_bytes)
+        # La predizione è asincrona: decodifica nel thread pool e inferenza
+        # a batch nello scheduler, così l'event loop non si blocca
+        result = await predict_image_model(img_bytes)
         
-        t3 = time.time()
-        ai_time = t3 - t2
-        total_time = t3 - start_time
+        total_time = time.perf_counter() - start_time
+        metrics.TOTAL.observe(total_time)
 
-        # STAMPA TEMPO AI
-        print(f"⚡ [DONE] Tempo AI: {ai_time:.2f}s | Tempo TOTALE server: {total_time:.2f}s", file=sys.stderr, flush=True)
+        if verbose:
+            print(f"⚡ [DONE] Tempo TOTALE server: {total_time:.2f}s", file=sys.stderr, flush=True)
 
         # 🚨 PROTEZIONE ANTI-CRASH 🚨
         if result is None:
@@ -118,26 +181,233 @@ async def predict_endpoint(file: UploadFile = File(...)):
 
         if "error" in result:
              print(f"❌ ERRORE NEL MODELLO: {result['error']}", file=sys.stderr, flush=True)
-             return JSONResponse(status_code=200, content={
-                 "error": result["error"],
-                 "material": "Errore",
-                 "bin": "N/A",
-                 "tip": result["error"],
-                 "color": "red",
-                 "confidence": 0.0
-             })
+             return JSONResponse(status_code=200, content=error_content(result["error"]))
              
         return result
 
     except HTTPException as he:
         raise he
     except Exception as e:
+        metrics.ERRORS.inc("server")
         print(f"❌ ERRORE GENERICO MAIN: {str(e)}", file=sys.stderr, flush=True)
-        return JSONResponse(status_code=200, content={
-             "error": str(e),
-             "material": "Errore Server",
-             "bin": "N/A",
-             "tip": "Si è verificato un errore imprevisto.",
-             "color": "red",
-             "confidence": 0.0
-        })
\ No newline at end of file
+        return JSONResponse(status_code=200, content=error_content(
+            str(e), "Errore Server", "Si è verificato un errore imprevisto."
+        ))
+
+# ==========================================
+# 🎥 CAMERA LIVE (WEBSOCKET)
+# ==========================================
+# Il client invia fotogrammi JPEG come messaggi binari sulla stessa connessione.
+# Si elabora sempre il fotogramma più recente (quelli rimasti indietro vengono scartati),
+# le probabilità sono mediate sugli ultimi fotogrammi e il risultato (stessa forma
+# di /predict) viene inviato solo quando cambia la classe stabile.
+@app.websocket("/ws/live")
+async def live_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    frames = LatestFrame()
+    smoother = ProbabilitySmoother()
+    max_bytes = LIVE_MAX_FRAME_KB * 1024
+    last_error = None
+
+    async def send_error(content: dict):
+        # Anche gli errori solo quando cambiano, non uno per fotogramma
+        nonlocal last_error
+        if content != last_error:
+            last_error = content
+            await websocket.send_json(content)
+
+    async def receive_frames():
+        oversize_reported = False
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                frame = message.get("bytes")
+                if frame is None:
+                    continue
+                if len(frame) > max_bytes:
+                    metrics.LIVE_FRAMES.inc("rejected")
+                    # Una sola volta per connessione: altrimenti la camera non saprebbe mai perché tace
+                    if not oversize_reported:
+                        oversize_reported = True
+                        await send_error(error_content(
+                            f"Fotogramma oltre {LIVE_MAX_FRAME_KB:g} KB",
+                            "Fotogramma troppo grande",
+                            "Riduci risoluzione o qualità JPEG della camera",
+                        ))
+                    continue
+                frames.put(frame)
+        finally:
+            frames.close()
+
+    receiver = asyncio.ensure_future(receive_frames())
+
+    try:
+        while True:
+            frame = await frames.get()
+            if frame is None:
+                break
+
+            if not is_model_ready():
+                metrics.LIVE_FRAMES.inc("not_ready")
+                if is_model_loading():
+                    await send_error({**error_content(WARMING_UP_MSG, "Avvio in corso"), "warming_up": True})
+                else:
+                    await send_error(error_content(model_status()["error"] or NOT_LOADED_MSG))
+                continue
+
+            try:
+                probs = await predict_probs_async(frame)
+            except Exception as e:
+                metrics.LIVE_FRAMES.inc("error")
+                metrics.ERRORS.inc("live_frame")
+                await send_error(error_content(str(e), "Fotogramma non valido", "Inquadra di nuovo l'oggetto"))
+                continue
+
+            metrics.LIVE_FRAMES.inc("processed")
+            changed = smoother.update(probs)
+            # Dopo un errore il client deve rivedere la classe stabile anche se non è cambiata
+            if changed or (last_error is not None and smoother.stable_index is not None):
+                last_error = None
+                await websocket.send_json(result_from_probs(smoother.smoothed))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+
+# ==========================================
+# 📦 PREDIZIONE A BATCH (NDJSON)
+# ==========================================
+def _read_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, max_bytes: int):
+    # La dimensione dichiarata nello zip può mentire: decomprimiamo al massimo max_bytes + 1 byte
+    with archive.open(info) as member:
+        data = member.read(max_bytes + 1)
+    return data if len(data) <= max_bytes else None
+
+
+async def _iter_uploads(files: List[UploadFile]):
+    # Restituisce (nome, byte, motivo) per ogni immagine: i file .zip vengono aperti
+    # e letti un membro alla volta, senza estrarre tutto l'archivio in memoria.
+    # Se il file viene scartato i byte sono None e il motivo è "archive", "too_large" o "format"
+    loop = asyncio.get_running_loop()
+    max_bytes = int(BATCH_MAX_FILE_MB * 1024 * 1024)
+
+    for upload in files:
+        if not upload.filename.lower().endswith(".zip"):
+            if not upload.filename.lower().endswith(VALID_EXTENSIONS):
+                yield upload.filename, None, "format"
+                continue
+            # Mai in memoria più di max_bytes + 1 byte, qualunque sia la dimensione del file
+            if upload.size is not None and upload.size > max_bytes:
+                yield upload.filename, None, "too_large"
+                continue
+            data = await upload.read(max_bytes + 1)
+            if len(data) > max_bytes:
+                yield upload.filename, None, "too_large"
+            else:
+                yield upload.filename, data, None
+            continue
+
+        try:
+            archive = zipfile.ZipFile(upload.file)
+        except zipfile.BadZipFile:
+            yield upload.filename, None, "archive"
+            continue
+
+        with archive:
+            for info in archive.infolist():
+                name = info.filename
+                base = os.path.basename(name)
+                # Saltiamo cartelle e file di sistema (__MACOSX, .DS_Store, ...)
+                if info.is_dir() or name.startswith("__MACOSX/") or base.startswith("."):
+                    continue
+                if not name.lower().endswith(VALID_EXTENSIONS):
+                    yield name, None, "format"
+                    continue
+                if info.file_size > max_bytes:
+                    yield name, None, "too_large"
+                    continue
+                try:
+                    data = await loop.run_in_executor(None, _read_member, archive, info, max_bytes)
+                except (zipfile.BadZipFile, zlib.error, RuntimeError, NotImplementedError, EOFError):
+                    # Membro corrotto, cifrato o con compressione non supportata:
+                    # errore solo per questa voce, le altre continuano ad arrivare
+                    yield name, None, "archive"
+                    continue
+                if data is None:
+                    yield name, None, "too_large"
+                    continue
+                yield name, data, None
+
+
+async def _predict_item(index: int, filename: str, img_bytes, reason: str = None) -> dict:
+    item = {"index": index, "filename": filename}
+
+    if reason == "archive":
+        metrics.ERRORS.inc("archive")
+        return {**item, **error_content(ARCHIVE_ERROR_MSG, "Archivio non valido", "Ricrea lo zip e riprova")}
+    if reason == "too_large":
+        metrics.ERRORS.inc("too_large")
+        return {**item, **error_content(
+            f"File troppo grande (massimo {BATCH_MAX_FILE_MB:g} MB)", "File troppo grande",
+            "Riduci la risoluzione della foto e riprova"
+        )}
+    if reason == "format":
+        metrics.ERRORS.inc("format")
+        metrics.REJECTED_FORMATS.inc(metrics.extension_label(filename))
+        return {**item, **error_content(FORMAT_ERROR_MSG, "Formato Errato")}
+    # Stessa risposta di /predict durante l'avvio: il client riconosce "warming_up" e riprova
+    if not is_model_ready() and is_model_loading():
+        metrics.ERRORS.inc("warming_up")
+        return {**item, **error_content(WARMING_UP_MSG, "Avvio in corso"), "warming_up": True}
+
+    try:
+        result = await predict_image_model(img_bytes)
+        if "error" in result:
+            return {**item, **error_content(result["error"])}
+        return {**item, **result}
+    except Exception as e:
+        metrics.ERRORS.inc("server")
+        return {**item, **error_content(str(e), "Errore Server", "Si è verificato un errore imprevisto.")}
+
+
+async def _stream_batch(files: List[UploadFile], verbose: bool = False):
+    start_time = time.perf_counter()
+    pending = set()
+    count = 0
+
+    def as_line(task):
+        return json.dumps(task.result(), ensure_ascii=False) + "\n"
+
+    # Finestra scorrevole: al massimo BATCH_ENDPOINT_WINDOW immagini in elaborazione,
+    # che lo scheduler unisce in batch veri. I risultati escono appena pronti.
+    try:
+        async for filename, img_bytes, reason in _iter_uploads(files):
+            pending.add(asyncio.ensure_future(_predict_item(count, filename, img_bytes, reason)))
+            count += 1
+            if len(pending) >= BATCH_ENDPOINT_WINDOW:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield as_line(task)
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield as_line(task)
+    finally:
+        # Client disconnesso: non lasciamo lavoro orfano
+        for task in pending:
+            task.cancel()
+
+    if verbose:
+        print(f"📦 [BATCH] {count} immagini in {time.perf_counter() - start_time:.2f}s", file=sys.stderr, flush=True)
+
+
+@app.post("/predict/batch")
+async def predict_batch_endpoint(files: List[UploadFile] = File(...)):
+    # Log dettagliato solo per una frazione delle richieste (LOG_SAMPLE_RATE), come /predict
+    verbose = metrics.sample_log()
+    if verbose:
+        print(f"\n➡️ RICHIESTA BATCH RICEVUTA! File: {len(files)}", file=sys.stderr, flush=True)
+    return StreamingResponse(_stream_batch(files, verbose), media_type="application/x-ndjson")
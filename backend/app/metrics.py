@@ -0,0 +1,127 @@
+import os
+import bisect
+import random
+import threading
+
+# ==========================================
+# 1. CONFIGURAZIONE METRICHE
+# ==========================================
+# Frazione di richieste con log dettagliato (0 = spento, 1 = tutte)
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONFIDENCE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+# Estensioni rifiutate contate una per una; le altre finiscono in "other".
+# Il nome del file arriva dal client: le etichette devono restare un insieme chiuso
+REJECTED_EXTENSIONS = (".heic", ".heif", ".webp", ".gif", ".bmp", ".tif", ".tiff", ".pdf", ".zip", ".mp4", ".mov")
+
+
+def sample_log() -> bool:
+    # Decide una volta per richiesta se scrivere i log dettagliati
+    return LOG_SAMPLE_RATE > 0 and random.random() < LOG_SAMPLE_RATE
+
+
+def extension_label(filename: str) -> str:
+    extension = os.path.splitext(filename.lower())[1]
+    if not extension:
+        return "(nessuna)"
+    return extension if extension in REJECTED_EXTENSIONS else "other"
+
+
+# ==========================================
+# 2. TIPI DI METRICA (formato testo Prometheus)
+# ==========================================
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"count": sum(self._counts), "sum": self._sum}
+
+    def render(self) -> list:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value: str, amount: int = 1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_value, value in values:
+            escaped = label_value.replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'{self.name}{{{self.label}="{escaped}"}} {value}')
+        return lines
+
+
+# ==========================================
+# 3. METRICHE DEL SERVIZIO
+# ==========================================
+UPLOAD_READ = Histogram("smarttrash_upload_read_seconds", "Tempo di lettura dell'upload")
+DECODE = Histogram("smarttrash_decode_seconds", "Decodifica JPEG/PNG a risoluzione ridotta")
+PREPROCESS = Histogram("smarttrash_preprocess_seconds", "Conversione RGB, resize e orientamento")
+QUEUE_WAIT = Histogram("smarttrash_queue_wait_seconds", "Attesa in coda prima del forward pass")
+INFERENCE = Histogram("smarttrash_inference_seconds", "Durata di un forward pass (per batch)")
+TOTAL = Histogram("smarttrash_request_total_seconds", "Tempo totale lato server di /predict")
+BATCH_SIZE = Histogram("smarttrash_batch_size", "Immagini per forward pass", BATCH_SIZE_BUCKETS)
+CONFIDENCE = Histogram("smarttrash_confidence", "Confidenza della classe predetta", CONFIDENCE_BUCKETS)
+
+PREDICTIONS = Counter("smarttrash_predictions_total", "Predizioni per classe", "class")
+ERRORS = Counter("smarttrash_errors_total", "Errori per tipo", "type")
+REJECTED_FORMATS = Counter("smarttrash_rejected_formats_total", "File rifiutati per estensione", "extension")
+LIVE_FRAMES = Counter("smarttrash_live_frames_total", "Fotogrammi di /ws/live per esito", "outcome")
+
+_ALL = (
+    UPLOAD_READ, DECODE, PREPROCESS, QUEUE_WAIT, INFERENCE, TOTAL, BATCH_SIZE, CONFIDENCE,
+    PREDICTIONS, ERRORS, REJECTED_FORMATS, LIVE_FRAMES,
+)
+
+
+def render(extra_gauges: dict = None) -> str:
+    lines = []
+    for metric in _ALL:
+        lines.extend(metric.render())
+    for name, value in (extra_gauges or {}).items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
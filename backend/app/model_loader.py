@@ -1,11 +1,19 @@
-import io
+import time
+# Riferimento per il report di avvio a freddo (TensorFlow NON viene importato qui)
+_MODULE_T0 = time.perf_counter()
 import numpy as np
-import tensorflow as tf
-from PIL import Image, ImageOps
 import os
+import queue
+import asyncio
 import logging
-# IMPORTANTE: Usiamo la funzione ufficiale di MobileNetV2 per la normalizzazione
-from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
+import threading
+from concurrent.futures import Future
+# Decodifica ridotta + normalizzazione MobileNetV2 nel buffer del batch
+from .preprocessing import BatchBuffer, decode, preprocess
+from .backends import KerasBackend, create_backend, model_fingerprint
+from .cache import PredictionCache, content_key, perceptual_key
+from .workers import SLOTS_PER_WORKER, WorkerPool
+from . import metrics
 
 # ==========================================
 # 1. CONFIGURAZIONE LOGGING
@@ -24,6 +32,28 @@ logging.basicConfig(
 IMG_SIZE = (224, 224)
 MODEL_PATH = "app/models/best_model.h5"
 
+# Backend di inferenza: keras | tf_function | tflite_fp16 | tflite_int8
+# (vedi backends.py; se il controllo di parità fallisce si torna a keras)
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "keras")
+
+# Micro-batching: quante immagini unire al massimo in un forward pass
+# e quanto aspettare (in ms) che arrivino altre richieste prima di partire
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "10"))
+
+# Processi di inferenza separati (0 = modello dentro il processo HTTP).
+# Con N > 0 il processo HTTP decodifica e basta, i tensori passano in memoria condivisa
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "0"))
+WORKERS_READY_TIMEOUT_S = float(os.environ.get("WORKERS_READY_TIMEOUT_S", "300"))
+WORKERS_ACQUIRE_TIMEOUT_S = float(os.environ.get("WORKERS_ACQUIRE_TIMEOUT_S", "30"))
+
+# Cache delle predizioni (0 voci = disattivata). La chiave percettiva (dHash)
+# riconosce anche le stesse foto ricompresse, ma è opzionale
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_MB = float(os.environ.get("CACHE_MAX_MB", "16"))
+CACHE_TTL_S = float(os.environ.get("CACHE_TTL_S", "3600"))
+CACHE_PERCEPTUAL = os.environ.get("CACHE_PERCEPTUAL", "0") == "1"
+
 # ORDINE DELLE CLASSI (Alfabetico)
 CLASS_NAMES = ['cardboard', 'glass', 'metal', 'paper', 'plastic', 'trash']
 
@@ -77,86 +107,431 @@ INFO_MAP = {
     }
 }
 
+WARMING_UP_MSG = "Modello in fase di avvio, riprova tra qualche secondo."
+NOT_LOADED_MSG = "Modello non caricato. Controlla i log."
+
+# Backend attivo (espone predict(batch) -> probabilità) oppure il pool di worker.
+# Resta None finché il modello non è caricato E scaldato
 _model = None
+_keras_model = None
+_pool = None
+
+# Per i contatori /metrics: dal nome mostrato al frontend alla classe del modello
+_MATERIAL_TO_CLASS = {info["it"]: name for name, info in INFO_MAP.items()}
+
+# Avanzamento del caricamento: idle -> loading -> warming_up -> ready | error
+_status = {"state": "idle", "backend": None, "error": None, "timings": {}}
+_status_lock = threading.Lock()
+
+
+# ==========================================
+# 3. SCHEDULER DI INFERENZA (MICRO-BATCHING)
+# ==========================================
+class InferenceScheduler:
+    """Unisce le richieste concorrenti in batch e le esegue su thread dedicati.
+
+    Le immagini arrivano già decodificate (uint8 224x224); ``run_batch`` riceve
+    la lista dei pixel del batch. Ogni chiamante riceve un ``Future`` con la
+    propria riga di probabilità.
+    """
+
+    _STOP = object()
+
+    def __init__(self, run_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, num_threads=1):
+        self._run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        # Più thread = più batch in volo (serve solo con il pool di worker)
+        self.num_threads = max(1, int(num_threads))
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.num_threads:
+                thread = threading.Thread(
+                    target=self._loop, name=f"inference-scheduler-{len(self._threads)}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        with self._lock:
+            alive = [t for t in self._threads if t.is_alive()]
+            for _ in alive:
+                self._queue.put(self._STOP)
+            for thread in alive:
+                thread.join()
+            self._threads = []
+
+    def submit(self, pixels: np.ndarray) -> Future:
+        future = Future()
+        self.start()
+        self._queue.put((pixels, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        # Blocca fino alla prima richiesta, poi raccoglie le altre
+        # finché il batch è pieno o scade l'attesa massima
+        first = self._queue.get()
+        if first is self._STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is self._STOP:
+                # Rimettiamo lo stop in coda: prima finiamo questo batch
+                self._queue.put(item)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            # Scartiamo le richieste annullate nel frattempo
+            started = time.perf_counter()
+            active = []
+            for arr, fut, queued in batch:
+                if fut.set_running_or_notify_cancel():
+                    metrics.QUEUE_WAIT.observe(started - queued)
+                    active.append((arr, fut))
+            batch = active
+            if not batch:
+                continue
+
+            try:
+                probs = self._run_batch([arr for arr, _ in batch])
+                metrics.INFERENCE.observe(time.perf_counter() - started)
+                metrics.BATCH_SIZE.observe(len(batch))
+            except Exception as e:
+                metrics.ERRORS.inc("inference")
+                logging.error(f"❌ Errore durante il batch di inferenza: {str(e)}")
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+
+            for i, (_, fut) in enumerate(batch):
+                fut.set_result(probs[i])
+
+
+def _run_model_batch(images) -> np.ndarray:
+    if _pool is not None:
+        return _pool.run_batch(images)
+    if _model is None:
+        # Modello scaricato (shutdown) mentre il batch era in coda
+        raise RuntimeError(NOT_LOADED_MSG)
+    # Un solo forward pass per tutto il batch, normalizzato nel buffer preallocato
+    return _model.predict(_batch_buffer.fill(images))
+
+
+_batch_buffer = BatchBuffer(BATCH_MAX_SIZE, IMG_SIZE)
+_scheduler = InferenceScheduler(_run_model_batch, num_threads=max(1, INFERENCE_WORKERS * SLOTS_PER_WORKER))
+_cache = PredictionCache(CACHE_MAX_ENTRIES, int(CACHE_MAX_MB * 1024 * 1024), CACHE_TTL_S)
+
+
+def start_scheduler():
+    _scheduler.start()
+
+
+def stop_scheduler():
+    _scheduler.stop()
+
+
+def unload_model():
+    global _model, _pool
+    if _pool is not None:
+        _pool.stop()
+    _model = None
+    _pool = None
+
+
+def worker_stats() -> list:
+    return _pool.stats() if _pool is not None else []
+
+
+# ==========================================
+# 4. CARICAMENTO IN BACKGROUND + WARM-UP
+# ==========================================
+def _elapsed_ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
+
+
+def _set_status(state: str, **fields):
+    with _status_lock:
+        _status["state"] = state
+        for key, value in fields.items():
+            if key.endswith("_ms"):
+                _status["timings"][key] = round(value, 1)
+            else:
+                _status[key] = value
+    logging.info(f"🚦 Stato modello: {state}")
+
+
+def model_status() -> dict:
+    with _status_lock:
+        status = {**_status, "timings": dict(_status["timings"])}
+    pool = _pool
+    if pool is not None:
+        status["workers_ready"] = sum(w["ready"] for w in pool.stats())
+        if status["state"] == "ready" and not pool.is_ready():
+            # Modello caricato, ma tutti i worker sono terminati o in riavvio
+            status["state"] = "workers_down"
+    return status
+
+
+def is_model_ready() -> bool:
+    # Con il pool serve anche almeno un worker pronto: possono terminare dopo l'avvio
+    pool = _pool
+    return _status["state"] == "ready" and (pool is None or pool.is_ready())
+
+
+def is_model_loading() -> bool:
+    return _status["state"] in ("idle", "loading", "warming_up")
+
+
+def _not_ready_error() -> dict:
+    return {"error": WARMING_UP_MSG if is_model_loading() else NOT_LOADED_MSG}
+
+
+def start_background_loading() -> threading.Thread:
+    # Il server risponde subito; modello e warm-up arrivano in un thread a parte
+    _set_status("loading", server_start_ms=_elapsed_ms(_MODULE_T0))
+    thread = threading.Thread(target=load_model, name="model-loader", daemon=True)
+    thread.start()
+    return thread
+
+
+def _warm_up(backend):
+    # Forward pass a vuoto con batch da 1 e da BATCH_MAX_SIZE: traccia i grafi
+    # (e alloca i tensori TFLite) prima che arrivi la prima richiesta vera
+    for n in sorted({1, BATCH_MAX_SIZE}):
+        backend.predict(np.zeros((n, IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.float32))
+
+
+def load_keras_model():
+    global _keras_model
+    if _keras_model is None:
+        import tensorflow as tf
+        # compile=False velocizza il caricamento
+        _keras_model = tf.keras.models.load_model(MODEL_PATH, compile=False)
+    return _keras_model
 
 def load_model():
-    global _model
-    logging.info(f"🔄 Tentativo caricamento modello da: {MODEL_PATH}")
+    global _model, _pool
+    if INFERENCE_WORKERS <= 0:
+        load_local_model()
+        return
+
+    if not os.path.exists(MODEL_PATH):
+        logging.error(f"❌ ERRORE: File {MODEL_PATH} non trovato.")
+        _set_status("error", error=f"File {MODEL_PATH} non trovato")
+        return
+
+    # Modalità multi-processo: il modello vive solo nei worker (che fanno anche il warm-up)
+    t0 = time.perf_counter()
+    _set_status("loading", backend=INFERENCE_BACKEND)
+    logging.info(f"🔄 Avvio di {INFERENCE_WORKERS} worker di inferenza (backend: {INFERENCE_BACKEND})")
+    _pool = WorkerPool(INFERENCE_WORKERS, BATCH_MAX_SIZE, IMG_SIZE, WORKERS_ACQUIRE_TIMEOUT_S)
+    _pool.start()
+    if not _pool.wait_ready(WORKERS_READY_TIMEOUT_S):
+        error = _pool.error or "Nessun worker di inferenza pronto entro il timeout"
+        logging.error(f"❌ Nessun worker di inferenza pronto: {error}")
+        _pool.stop()
+        _pool = None
+        _set_status("error", error=error)
+        return
+
+    # Versione della cache e stato col backend davvero attivo nei worker (fallback keras compreso)
+    backend_name = _pool.backend
+    _cache.set_model_version(f"{backend_name}:{model_fingerprint(MODEL_PATH)}")
+    _model = _pool
+    _set_status("ready", backend=backend_name, load_ms=_elapsed_ms(t0), total_ms=_elapsed_ms(_MODULE_T0))
+
+def load_local_model():
+    global _model, _keras_model
+    logging.info(f"🔄 Tentativo caricamento modello da: {MODEL_PATH} (backend: {INFERENCE_BACKEND})")
     
     if os.path.exists(MODEL_PATH):
         try:
-            # compile=False velocizza il caricamento
-            _model = tf.keras.models.load_model(MODEL_PATH, compile=False)
-            logging.info("✅ MODELLO MOBILENET V2 CARICATO CON SUCCESSO!")
+            t0 = time.perf_counter()
+            _set_status("loading", backend=INFERENCE_BACKEND)
+            try:
+                backend = create_backend(INFERENCE_BACKEND, MODEL_PATH, load_keras_model, preprocess)
+            except Exception as e:
+                # Qualsiasi problema del backend leggero (parità, conversione, calibrazione,
+                # file non scrivibili accanto al modello...) non deve lasciarci senza modello
+                if INFERENCE_BACKEND == "keras":
+                    raise
+                logging.error(f"❌ Backend {INFERENCE_BACKEND} non attivato: {type(e).__name__}: {str(e)}. Uso keras.")
+                backend = KerasBackend(load_keras_model())
+
+            # Con TFLite/SavedModel il modello Keras serve solo per conversione/parità: liberiamo la memoria
+            if backend.name not in ("keras", "tf_function"):
+                _keras_model = None
+
+            # Nuovo modello (o nuovo backend) -> le predizioni in cache non valgono più
+            _cache.set_model_version(f"{backend.name}:{model_fingerprint(MODEL_PATH)}")
+
+            _set_status("warming_up", backend=backend.name, load_ms=_elapsed_ms(t0))
+            t1 = time.perf_counter()
+            _warm_up(backend)
+            _model = backend
+
+            _set_status("ready", warmup_ms=_elapsed_ms(t1), total_ms=_elapsed_ms(_MODULE_T0))
+            timings = _status["timings"]
+            logging.info(f"✅ MODELLO MOBILENET V2 CARICATO CON SUCCESSO! (backend: {backend.name})")
+            logging.info(
+                f"⏱️ Avvio a freddo: caricamento {timings['load_ms']:.0f} ms | "
+                f"warm-up {timings['warmup_ms']:.0f} ms | totale {timings['total_ms']:.0f} ms"
+            )
         except Exception as e:
             logging.error(f"❌ CRASH caricamento modello: {str(e)}")
+            _set_status("error", error=str(e))
     else:
         logging.error(f"❌ ERRORE: File {MODEL_PATH} non trovato.")
+        _set_status("error", error=f"File {MODEL_PATH} non trovato")
 
-def predict(image_bytes: bytes) -> dict:
-    global _model
-    
-    logging.info("\n--- 📸 NUOVA RICHIESTA ANALISI ---")
-    
-    if _model is None: 
-        return {"error": "Modello non caricato. Controlla i log."}
+def _prepare_image(image_bytes: bytes, verbose: bool = False) -> np.ndarray:
+    # 1-4. Decodifica ridotta (draft JPEG), orientamento EXIF, RGB e resize
+    #      (la normalizzazione MobileNetV2 avviene poi nel buffer del batch)
+    timings = {}
+    pixels = decode(image_bytes, IMG_SIZE, timings)
+    metrics.DECODE.observe(timings["decode_ms"] / 1000)
+    metrics.PREPROCESS.observe(timings["resize_ms"] / 1000)
+    if verbose:
+        logging.info(
+            f"⏱️ Preprocessing: decode {timings['decode_ms']:.1f} ms | resize {timings['resize_ms']:.1f} ms"
+        )
+    return pixels
 
-    try:
-        # 1. Apertura Immagine
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        # 2. Correzione Orientamento (Exif)
-        img = ImageOps.exif_transpose(img)
-        
-        # 3. Conversione RGB
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-        
-        # 4. Resize
-        img = img.resize(IMG_SIZE)
-        
-        # 5. Pre-processing MobileNetV2
-        img_array = np.array(img)
-        img_processed = preprocess_input(img_array)
-        img_batch = np.expand_dims(img_processed, axis=0)
-
-        # 6. Predizione
-        predictions = _model.predict(img_batch)
-        probs = predictions[0]
-
-        # 7. Log Risultati
+
+def _build_result(probs: np.ndarray, verbose: bool = False) -> dict:
+    predicted_index = int(np.argmax(probs))
+
+    # 7. Log Risultati (solo per le richieste campionate)
+    if verbose:
         logging.info("📊 Risultati Analisi:")
         for i, class_name in enumerate(CLASS_NAMES):
-            perc = probs[i] * 100
-            marker = " << VINCENTE" if perc == max(probs*100) else ""
-            logging.info(f"   • {class_name.upper().ljust(10)}: {perc:.2f}% {marker}")
-        
-        # 8. Risultato Finale
-        predicted_index = np.argmax(probs)
-        confidence = float(probs[predicted_index])
-        raw_label = CLASS_NAMES[predicted_index]
-
-        info = INFO_MAP.get(raw_label)
-        
-        # Costruzione Risposta
-        if info:
-            return {
-                "material": info["it"],
-                "bin": info["bin"],
-                "tip": info["tip"],
-                "color": info["color"],
-                "confidence": round(confidence, 2)
-            }
-        else:
-            return {
-                "material": raw_label,
-                "bin": "INDIFFERENZIATO",
-                "tip": "Nessun consiglio disponibile",
-                "color": "#999999",
-                "confidence": round(confidence, 2)
-            }
+            marker = " << VINCENTE" if i == predicted_index else ""
+            logging.info(f"   • {class_name.upper().ljust(10)}: {probs[i] * 100:.2f}% {marker}")
+
+    # 8. Risultato Finale
+    confidence = float(probs[predicted_index])
+    raw_label = CLASS_NAMES[predicted_index]
+
+    info = INFO_MAP.get(raw_label)
+
+    # Costruzione Risposta
+    if info:
+        return {
+            "material": info["it"],
+            "bin": info["bin"],
+            "tip": info["tip"],
+            "color": info["color"],
+            "confidence": round(confidence, 2)
+        }
+    else:
+        return {
+            "material": raw_label,
+            "bin": "INDIFFERENZIATO",
+            "tip": "Nessun consiglio disponibile",
+            "color": "#999999",
+            "confidence": round(confidence, 2)
+        }
+
+
+def _record_prediction(result: dict):
+    metrics.PREDICTIONS.inc(_MATERIAL_TO_CLASS.get(result["material"], result["material"]))
+    metrics.CONFIDENCE.observe(result["confidence"])
+
+
+def _lookup_or_prepare(image_bytes: bytes, verbose: bool = False):
+    # Restituisce (risultato in cache, chiavi, pixel): se c'è un hit i pixel sono None
+    if not _cache.enabled:
+        return None, [], _prepare_image(image_bytes, verbose)
+
+    keys = [content_key(image_bytes)]
+    cached = _cache.get(keys[0])
+    if cached is not None:
+        return cached, keys, None
+
+    pixels = _prepare_image(image_bytes, verbose)
+    if CACHE_PERCEPTUAL:
+        keys.append(perceptual_key(pixels))
+        cached = _cache.get(keys[1], "perceptual")
+        if cached is not None:
+            _cache.put(keys[:1], cached)
+            return cached, keys, None
+
+    _cache.record_miss()
+    return None, keys, pixels
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
+
+
+async def predict_async(image_bytes: bytes) -> dict:
+    # Unico percorso di predizione (non bloccante): la decodifica gira nel thread pool
+    # e l'inferenza nello scheduler, così l'event loop resta libero
+    verbose = metrics.sample_log()
+    if verbose:
+        logging.info("\n--- 📸 NUOVA RICHIESTA ANALISI ---")
+
+    if _model is None:
+        metrics.ERRORS.inc("not_ready")
+        return _not_ready_error()
+
+    try:
+        loop = asyncio.get_running_loop()
+        cached, keys, pixels = await loop.run_in_executor(None, _lookup_or_prepare, image_bytes, verbose)
+        if cached is not None:
+            if verbose:
+                logging.info("⚡ Risultato dalla cache")
+            _record_prediction(cached)
+            return cached
+
+        probs = await asyncio.wrap_future(_scheduler.submit(pixels))
+
+        result = _build_result(probs, verbose)
+        _cache.put(keys, result)
+        _record_prediction(result)
+        return result
 
     except Exception as e:
+        metrics.ERRORS.inc(type(e).__name__)
         logging.error(f"❌ Errore durante la predizione: {str(e)}")
         # Importante: restituiamo un dizionario con l'errore, NON None
         return {"error": str(e)}
+
+
+async def predict_probs_async(image_bytes: bytes) -> np.ndarray:
+    # Probabilità grezze per lo stream live (/ws/live): niente cache, ogni
+    # fotogramma è diverso; la media sui fotogrammi la fa il chiamante
+    if _model is None:
+        raise RuntimeError(_not_ready_error()["error"])
+
+    loop = asyncio.get_running_loop()
+    pixels = await loop.run_in_executor(None, _prepare_image, image_bytes)
+    return await asyncio.wrap_future(_scheduler.submit(pixels))
+
+
+def result_from_probs(probs: np.ndarray) -> dict:
+    # Stessa risposta di /predict a partire da probabilità già calcolate (es. mediate)
+    result = _build_result(np.asarray(probs))
+    _record_prediction(result)
+    return result
@@ -0,0 +1,125 @@
+import io
+import time
+import numpy as np
+from PIL import Image
+
+# ==========================================
+# 1. CONFIGURAZIONE PREPROCESSING
+# ==========================================
+IMG_SIZE = (224, 224)
+
+# Tag EXIF "Orientation" e trasformazione equivalente (come ImageOps.exif_transpose)
+EXIF_ORIENTATION_TAG = 0x0112
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+# Orientamenti che scambiano larghezza e altezza
+_SWAPS_AXES = (5, 6, 7, 8)
+
+
+def _elapsed_ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
+
+
+# ==========================================
+# 2. DECODIFICA A RISOLUZIONE RIDOTTA
+# ==========================================
+def decode(image_bytes: bytes, size=IMG_SIZE, timings: dict = None) -> np.ndarray:
+    """Decodifica l'immagine direttamente a ``size`` e la restituisce come uint8 HxWx3.
+
+    Se ``timings`` è un dizionario, ci scrive la durata (ms) di ogni fase.
+    """
+    t0 = time.perf_counter()
+    img = Image.open(io.BytesIO(image_bytes))
+
+    # 1. Orientamento letto dall'EXIF: la rotazione la applichiamo dopo,
+    #    sull'immagine già piccola, invece di ruotare la foto da 12MP
+    orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    target = (size[1], size[0]) if orientation in _SWAPS_AXES else size
+
+    # 2. JPEG: riduzione nel dominio DCT (draft) -> decodifica già vicina a 224x224
+    if img.format == "JPEG":
+        img.draft("RGB", target)
+    img.load()
+    if timings is not None:
+        timings["decode_ms"] = _elapsed_ms(t0)
+
+    # 3. Conversione RGB + Resize + Orientamento
+    t1 = time.perf_counter()
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img = img.resize(target)
+    if orientation in ORIENTATION_TRANSPOSE:
+        img = img.transpose(ORIENTATION_TRANSPOSE[orientation])
+    pixels = np.asarray(img, dtype=np.uint8)
+    if timings is not None:
+        timings["resize_ms"] = _elapsed_ms(t1)
+
+    return pixels
+
+
+# ==========================================
+# 3. NORMALIZZAZIONE MOBILENETV2
+# ==========================================
+def normalize_into(pixels: np.ndarray, out: np.ndarray) -> np.ndarray:
+    # Stessa formula di mobilenet_v2.preprocess_input ([-1, 1]),
+    # scritta direttamente nel buffer di destinazione senza copie intermedie
+    np.multiply(pixels, 1 / 127.5, out=out, casting="unsafe")
+    out -= 1.0
+    return out
+
+
+def preprocess(image_bytes: bytes, size=IMG_SIZE, timings: dict = None) -> np.ndarray:
+    """Decodifica + normalizzazione di una singola immagine (float32 HxWx3)."""
+    pixels = decode(image_bytes, size, timings)
+    t0 = time.perf_counter()
+    out = normalize_into(pixels, np.empty(pixels.shape, dtype=np.float32))
+    if timings is not None:
+        timings["normalize_ms"] = _elapsed_ms(t0)
+    return out
+
+
+class BatchBuffer:
+    """Buffer float32 preallocato in cui vengono normalizzate le immagini di un batch."""
+
+    def __init__(self, max_batch_size: int, size=IMG_SIZE):
+        self._data = np.empty((max_batch_size, size[1], size[0], 3), dtype=np.float32)
+
+    def fill(self, images) -> np.ndarray:
+        batch = self._data[:len(images)]
+        for i, pixels in enumerate(images):
+            normalize_into(pixels, batch[i])
+        return batch
+
+
+if __name__ == "__main__":
+    # Uso: python -m app.preprocessing foto1.jpg foto2.jpg ...
+    # Confronta il vecchio percorso (decodifica completa) con quello nuovo
+    import sys
+    from PIL import ImageOps
+
+    def legacy(image_bytes):
+        img = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img = img.resize(IMG_SIZE)
+        return np.expand_dims(np.array(img).astype(np.float32) / 127.5 - 1.0, axis=0)
+
+    for path in sys.argv[1:]:
+        with open(path, "rb") as f:
+            data = f.read()
+        t0 = time.perf_counter()
+        legacy(data)
+        print(f"{path} [vecchio] totale {_elapsed_ms(t0):.1f} ms")
+
+        timings = {}
+        t0 = time.perf_counter()
+        preprocess(data, timings=timings)
+        stages = "".join(f" | {k} {v:.1f}" for k, v in timings.items())
+        print(f"{path} [nuovo] totale {_elapsed_ms(t0):.1f} ms{stages}")
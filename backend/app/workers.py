@@ -0,0 +1,302 @@
+import time
+import logging
+import threading
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import Future
+import numpy as np
+from .preprocessing import normalize_into
+
+# ==========================================
+# 1. CONFIGURAZIONE POOL
+# ==========================================
+# Ogni worker ha più "slot" di memoria condivisa: mentre il modello lavora
+# su un batch, il processo HTTP può già preparare il successivo
+SLOTS_PER_WORKER = 2
+RESTART_DELAY_S = 1.0
+
+# spawn (non fork): ogni worker parte pulito e carica TensorFlow per conto suo
+_mp = multiprocessing.get_context("spawn")
+
+
+class WorkerCrashed(RuntimeError):
+    """Il processo di inferenza è terminato mentre elaborava un batch."""
+
+
+# ==========================================
+# 2. PROCESSO WORKER
+# ==========================================
+def load_model_backend():
+    # Caricamento predefinito dei worker: lo stesso del processo HTTP senza pool
+    # (mai un pool annidato). Restituisce (backend, tempi di avvio)
+    from . import model_loader
+
+    model_loader.load_local_model()
+    status = model_loader.model_status()
+    if model_loader._model is None:
+        raise RuntimeError(status["error"] or model_loader.NOT_LOADED_MSG)
+    return model_loader._model, status["timings"]
+
+
+def _worker_main(conn, shm_names, batch_shape, load_backend):
+    try:
+        backend, timings = load_backend()
+    except Exception as e:
+        # Caricamento fallito (file corrotto, errore TF...): lo segnaliamo invece di dichiararci pronti
+        conn.send(("error", str(e)))
+        conn.close()
+        return
+
+    # La memoria appartiene al processo HTTP (che la libera in stop()):
+    # con spawn il resource tracker è condiviso, quindi qui basta agganciarsi
+    shms = [SharedMemory(name=name) for name in shm_names]
+    buffers = [np.ndarray(batch_shape, dtype=np.float32, buffer=shm.buf) for shm in shms]
+
+    conn.send(("ready", backend.name, timings))
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg is None:
+            break
+
+        slot, n = msg
+        try:
+            probs = np.asarray(backend.predict(buffers[slot][:n]), dtype=np.float32)
+            conn.send(("result", slot, probs, None))
+        except Exception as e:
+            conn.send(("result", slot, None, str(e)))
+
+    del buffers
+    for shm in shms:
+        shm.close()
+
+
+# ==========================================
+# 3. POOL LATO PROCESSO HTTP
+# ==========================================
+class _Worker:
+    def __init__(self, worker_id: int, batch_shape):
+        self.id = worker_id
+        self.shms = [
+            SharedMemory(create=True, size=int(np.prod(batch_shape)) * 4) for _ in range(SLOTS_PER_WORKER)
+        ]
+        self.buffers = [np.ndarray(batch_shape, dtype=np.float32, buffer=shm.buf) for shm in self.shms]
+        self.free_slots = list(range(SLOTS_PER_WORKER))
+        self.futures = {}
+        self.load = 0
+        self.ready = False
+        self.backend = None
+        self.error = None
+        self.timings = {}
+        self.restarts = 0
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+
+
+class WorkerPool:
+    """Pool di processi di inferenza che ricevono i tensori tramite memoria condivisa.
+
+    Ogni batch va al worker pronto con meno immagini in elaborazione; i worker
+    che terminano in modo anomalo vengono riavviati automaticamente.
+    """
+
+    def __init__(self, num_workers: int, max_batch_size: int, img_size, acquire_timeout: float = None,
+                 load_backend=load_model_backend):
+        self.name = "workers"
+        self.num_workers = num_workers
+        # Funzione (a livello di modulo, deve passare a spawn) che il worker usa per caricare il backend
+        self.load_backend = load_backend
+        # Attesa massima di un worker libero: con tutti i worker giù il batch fallisce invece di bloccarsi
+        self.acquire_timeout = acquire_timeout
+        self.batch_shape = (max_batch_size, img_size[1], img_size[0], 3)
+        self._workers = []
+        self._cond = threading.Condition()
+        self._stopping = False
+
+    def start(self):
+        self._stopping = False
+        self._workers = [_Worker(i, self.batch_shape) for i in range(self.num_workers)]
+        for worker in self._workers:
+            self._spawn(worker)
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        # Attende il primo worker pronto; False se scade il timeout o se tutti i worker
+        # non sono riusciti a caricare il modello (vedi ``error``)
+        with self._cond:
+            self._cond.wait_for(
+                lambda: any(w.ready for w in self._workers) or all(w.error for w in self._workers), timeout
+            )
+            return any(w.ready for w in self._workers)
+
+    def is_ready(self) -> bool:
+        # Almeno un worker vivo e con il modello caricato
+        with self._cond:
+            return any(w.ready for w in self._workers)
+
+    @property
+    def backend(self):
+        # Backend effettivamente attivato dai worker (può differire da quello richiesto)
+        with self._cond:
+            return next((w.backend for w in self._workers if w.ready), None)
+
+    @property
+    def error(self):
+        with self._cond:
+            return next((w.error for w in self._workers if w.error), None)
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except (OSError, AttributeError):
+                pass
+            if worker.process is not None:
+                worker.process.join(timeout=10)
+                if worker.process.is_alive():
+                    worker.process.kill()
+            del worker.buffers
+            for shm in worker.shms:
+                shm.close()
+                shm.unlink()
+        self._workers = []
+
+    def stats(self) -> list:
+        with self._cond:
+            return [
+                {
+                    "id": w.id, "ready": w.ready, "backend": w.backend, "load": w.load,
+                    "restarts": w.restarts, "timings": w.timings, "error": w.error,
+                }
+                for w in self._workers
+            ]
+
+    def run_batch(self, images) -> np.ndarray:
+        worker, slot = self._acquire(len(images))
+        try:
+            # Normalizzazione direttamente nella memoria condivisa del worker
+            buffer = worker.buffers[slot]
+            for i, pixels in enumerate(images):
+                normalize_into(pixels, buffer[i])
+
+            future = Future()
+            with self._cond:
+                worker.futures[slot] = future
+            try:
+                with worker.send_lock:
+                    worker.conn.send((slot, len(images)))
+            except (OSError, BrokenPipeError) as e:
+                raise WorkerCrashed(f"Worker {worker.id} non raggiungibile: {e}")
+            return future.result()
+        finally:
+            self._release(worker, slot, len(images))
+
+    def _acquire(self, n: int):
+        deadline = None if self.acquire_timeout is None else time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                if self._stopping:
+                    raise RuntimeError("Pool di inferenza in chiusura")
+                candidates = [w for w in self._workers if w.ready and w.free_slots]
+                if candidates:
+                    worker = min(candidates, key=lambda w: w.load)
+                    worker.load += n
+                    return worker, worker.free_slots.pop()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise WorkerCrashed("Nessun worker di inferenza disponibile")
+                self._cond.wait(remaining)
+
+    def _release(self, worker: _Worker, slot: int, n: int):
+        with self._cond:
+            worker.futures.pop(slot, None)
+            worker.free_slots.append(slot)
+            worker.load -= n
+            self._cond.notify_all()
+
+    def _spawn(self, worker: _Worker):
+        parent_conn, child_conn = _mp.Pipe()
+        process = _mp.Process(
+            target=_worker_main,
+            args=(child_conn, [shm.name for shm in worker.shms], self.batch_shape, self.load_backend),
+            name=f"inference-worker-{worker.id}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker.process = process
+        worker.conn = parent_conn
+        threading.Thread(
+            target=self._reader, args=(worker, parent_conn), name=f"inference-worker-{worker.id}-reader", daemon=True
+        ).start()
+
+    def _reader(self, worker: _Worker, conn):
+        # Riceve le risposte del worker e risveglia chi aspetta il batch
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if msg[0] == "ready":
+                with self._cond:
+                    worker.ready = True
+                    worker.backend = msg[1]
+                    worker.timings = msg[2]
+                    self._cond.notify_all()
+                logging.info(f"✅ Worker di inferenza {worker.id} pronto (backend: {msg[1]})")
+                continue
+
+            if msg[0] == "error":
+                with self._cond:
+                    worker.error = msg[1]
+                    self._cond.notify_all()
+                logging.error(f"❌ Worker di inferenza {worker.id}: caricamento modello fallito: {msg[1]}")
+                continue
+
+            _, slot, probs, error = msg
+            with self._cond:
+                future = worker.futures.get(slot)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(probs)
+
+        self._on_worker_exit(worker, conn)
+
+    def _on_worker_exit(self, worker: _Worker, conn):
+        conn.close()
+        with self._cond:
+            worker.ready = False
+            pending = list(worker.futures.values())
+            worker.futures.clear()
+            stopping = self._stopping
+            self._cond.notify_all()
+
+        for future in pending:
+            if not future.done():
+                future.set_exception(WorkerCrashed(f"Worker di inferenza {worker.id} terminato"))
+        if stopping:
+            return
+        if worker.error is not None:
+            # Il modello non si carica: riavviare il worker porterebbe allo stesso errore
+            worker.process.join(timeout=1)
+            return
+
+        # Crash: il worker viene riavviato con la stessa memoria condivisa
+        worker.process.join(timeout=1)
+        logging.error(f"❌ Worker di inferenza {worker.id} terminato (exit code {worker.process.exitcode}). Riavvio...")
+        time.sleep(RESTART_DELAY_S)
+        with self._cond:
+            if self._stopping:
+                return
+            worker.restarts += 1
+        self._spawn(worker)
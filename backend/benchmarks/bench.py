@@ -0,0 +1,332 @@
+"""Benchmark del backend SmartTrash AI (dentro il processo, senza rete).
+
+Uso (dalla cartella backend/):
+    python -m benchmarks.bench --concurrency 1 8 32 --requests 300
+    python -m benchmarks.bench --rate 20 --requests 200
+    python -m benchmarks.bench --update-baseline      # salva i numeri attuali come riferimento
+
+Se esiste il baseline, il comando termina con codice 1 quando una misura
+peggiora oltre la tolleranza (--tolerance).
+"""
+import os
+import sys
+import json
+import time
+import glob
+import random
+import asyncio
+import argparse
+import resource
+import platform
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATASET = os.path.join(BENCH_DIR, "..", "..", "ai", "data", "trashnet")
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, "results", "latest.json")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+STAGES = ("upload_read", "decode", "preprocess", "queue_wait", "inference", "total")
+
+
+# ==========================================
+# 1. UTILITÀ
+# ==========================================
+def percentiles(values_s) -> dict:
+    if not values_s:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    ms = np.asarray(values_s) * 1000
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 2),
+        "p95": round(float(np.percentile(ms, 95)), 2),
+        "p99": round(float(np.percentile(ms, 99)), 2),
+        "mean": round(float(np.mean(ms)), 2),
+    }
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss è in KB su Linux, in byte su macOS.
+    # RUSAGE_CHILDREN = il più grande dei processi figli già terminati (i worker di inferenza)
+    rss = resource.getrusage(who).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def load_images(dataset_dir: str, limit: int) -> list:
+    paths = sorted(glob.glob(os.path.join(dataset_dir, "*", "*.jpg")))
+    if not paths:
+        raise SystemExit(f"❌ Nessuna immagine trovata in {dataset_dir}")
+    random.Random(0).shuffle(paths)
+    images = []
+    for path in paths[:limit]:
+        with open(path, "rb") as f:
+            images.append((os.path.basename(path), f.read()))
+    return images
+
+
+def stage_snapshot() -> dict:
+    from app import metrics
+    histograms = {
+        "upload_read": metrics.UPLOAD_READ, "decode": metrics.DECODE, "preprocess": metrics.PREPROCESS,
+        "queue_wait": metrics.QUEUE_WAIT, "inference": metrics.INFERENCE, "total": metrics.TOTAL,
+    }
+    return {name: h.snapshot() for name, h in histograms.items()}
+
+
+def stage_means_ms(before: dict, after: dict) -> dict:
+    # Media per fase calcolata dalla differenza degli istogrammi di /metrics
+    means = {}
+    for stage in STAGES:
+        count = after[stage]["count"] - before[stage]["count"]
+        total = after[stage]["sum"] - before[stage]["sum"]
+        means[stage] = round(total / count * 1000, 2) if count else None
+    return means
+
+
+# ==========================================
+# 2. CARICO HTTP (CLIENT ASGI IN-PROCESS)
+# ==========================================
+async def run_load(client, images, requests: int, concurrency: int, rate: float) -> dict:
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            name, data = images[i % len(images)]
+            t0 = time.perf_counter()
+            response = await client.post("/predict", files={"file": (name, data, "image/jpeg")})
+            latencies.append(time.perf_counter() - t0)
+            if response.status_code != 200 or "error" in response.json():
+                errors += 1
+
+    before = stage_snapshot()
+    start = time.perf_counter()
+    tasks = []
+    for i in range(requests):
+        if rate > 0:
+            # Carico "open loop": le richieste arrivano a ritmo fisso, pronte o no
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(one(i)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "rate": rate,
+        "requests": requests,
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2),
+        "latency_ms": percentiles(latencies),
+        "stages_mean_ms": stage_means_ms(before, stage_snapshot()),
+    }
+
+
+async def wait_ready(client, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = await client.get("/ready")
+        if response.status_code == 200:
+            return response.json()
+        if response.json().get("state") == "error":
+            raise SystemExit(f"❌ Modello non caricato: {response.json().get('error')}")
+        await asyncio.sleep(0.2)
+    raise SystemExit("❌ Modello non pronto entro il timeout")
+
+
+async def run_http(args, images) -> tuple:
+    import httpx
+    from app.main import app
+
+    # Eseguiamo startup/shutdown dell'app come farebbe uvicorn
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            status = await wait_ready(client, args.ready_timeout)
+            print(f"✅ Modello pronto (backend: {status['backend']}, avvio {status['timings'].get('total_ms')} ms)")
+
+            # Qualche richiesta di riscaldamento, esclusa dalle misure
+            await run_load(client, images, min(len(images), 8), 4, 0)
+
+            runs = []
+            for concurrency in args.concurrency:
+                result = await run_load(client, images, args.requests, concurrency, args.rate)
+                lat = result["latency_ms"]
+                print(
+                    f"📈 concorrenza {concurrency:>3} | {result['throughput_rps']:>7.2f} req/s | "
+                    f"p50 {lat['p50']} ms | p95 {lat['p95']} ms | p99 {lat['p99']} ms | errori {result['errors']}"
+                )
+                runs.append(result)
+
+        micro = None if args.no_micro else run_micro(images, args.micro_iterations)
+    return status, runs, micro
+
+
+# ==========================================
+# 3. MICRO-BENCHMARK PER FASE
+# ==========================================
+def run_micro(images, iterations: int) -> dict:
+    from app import model_loader
+    from app.preprocessing import decode, normalize_into
+
+    decode_s, resize_s, normalize_s = [], [], []
+    pixels = []
+    out = np.empty((*model_loader.IMG_SIZE[::-1], 3), dtype=np.float32)
+    for i in range(iterations):
+        _, data = images[i % len(images)]
+        timings = {}
+        px = decode(data, model_loader.IMG_SIZE, timings)
+        decode_s.append(timings["decode_ms"] / 1000)
+        resize_s.append(timings["resize_ms"] / 1000)
+        t0 = time.perf_counter()
+        normalize_into(px, out)
+        normalize_s.append(time.perf_counter() - t0)
+        pixels.append(px)
+
+    micro = {
+        "decode": percentiles(decode_s),
+        "preprocess": percentiles(resize_s),
+        "normalize": percentiles(normalize_s),
+    }
+
+    backend = model_loader._model
+    if backend is not None and hasattr(backend, "predict"):
+        for batch_size in sorted({1, model_loader.BATCH_MAX_SIZE}):
+            batch = np.empty((batch_size, *out.shape), dtype=np.float32)
+            for i in range(batch_size):
+                normalize_into(pixels[i % len(pixels)], batch[i])
+            model_s = []
+            for _ in range(max(3, iterations // batch_size)):
+                t0 = time.perf_counter()
+                backend.predict(batch)
+                model_s.append(time.perf_counter() - t0)
+            micro[f"model_batch{batch_size}"] = percentiles(model_s)
+
+    for stage, values in micro.items():
+        print(f"🔬 {stage:<16} p50 {values['p50']} ms | p95 {values['p95']} ms")
+    return micro
+
+
+# ==========================================
+# 4. CONFRONTO CON IL BASELINE
+# ==========================================
+def failed_runs(report: dict) -> list:
+    # Una run con errori non è un risultato valido (modello non pronto, worker giù...):
+    # latenze e throughput di risposte d'errore possono sembrare ottimi
+    return [
+        f"concorrenza {run['concurrency']}, rate {run['rate']}: {run['errors']} errori su {run['requests']} richieste"
+        for run in report["load"]
+        if run["errors"] > 0
+    ]
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    regressions = failed_runs(report)
+    base_runs = {(r["concurrency"], r["rate"]): r for r in baseline.get("load", [])}
+    for run in report["load"]:
+        base = base_runs.get((run["concurrency"], run["rate"]))
+        if base is None:
+            continue
+        tag = f"concorrenza {run['concurrency']}, rate {run['rate']}"
+        if run["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{tag}: throughput {run['throughput_rps']} < {base['throughput_rps']} req/s")
+        for q in ("p95", "p99"):
+            if run["latency_ms"][q] > base["latency_ms"][q] * (1 + tolerance):
+                regressions.append(f"{tag}: {q} {run['latency_ms'][q]} > {base['latency_ms'][q]} ms")
+
+    for stage, values in report.get("micro", {}).items():
+        base = baseline.get("micro", {}).get(stage)
+        if base and base["p50"] and values["p50"] > base["p50"] * (1 + tolerance):
+            regressions.append(f"micro {stage}: p50 {values['p50']} > {base['p50']} ms")
+
+    for key, label in (("peak_rss_mb", "picco RSS"), ("peak_rss_workers_mb", "picco RSS worker")):
+        base_rss = baseline.get(key)
+        if base_rss and report.get(key, 0) > base_rss * (1 + tolerance):
+            regressions.append(f"{label} {report[key]} > {base_rss} MB")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di carico e latenza del backend SmartTrash AI")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="cartella trashnet (sottocartelle per classe)")
+    parser.add_argument("--images", type=int, default=200, help="immagini del dataset da usare")
+    parser.add_argument("--requests", type=int, default=200, help="richieste per ogni livello di concorrenza")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--rate", type=float, default=0, help="richieste/s a ritmo fisso (0 = il più veloce possibile)")
+    parser.add_argument("--micro-iterations", type=int, default=50)
+    parser.add_argument("--no-micro", action="store_true", help="salta i micro-benchmark per fase")
+    parser.add_argument("--with-cache", action="store_true", help="lascia attiva la cache delle predizioni")
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.15, help="peggioramento ammesso (0.15 = 15%%)")
+    parser.add_argument("--update-baseline", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if not args.with_cache:
+        # Le stesse immagini tornano più volte: senza questo misureremmo la cache, non il modello
+        os.environ["CACHE_MAX_ENTRIES"] = "0"
+
+    images = load_images(args.dataset, args.images)
+    print(f"🗂️ {len(images)} immagini da {os.path.abspath(args.dataset)}")
+
+    status, runs, micro = asyncio.run(run_http(args, images))
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "backend": status["backend"],
+            "inference_workers": int(os.environ.get("INFERENCE_WORKERS", "0")),
+            "cache": args.with_cache,
+        },
+        "startup_ms": status["timings"],
+        "load": runs,
+    }
+    if micro is not None:
+        report["micro"] = micro
+    report["peak_rss_mb"] = peak_rss_mb()
+    # Con INFERENCE_WORKERS > 0 il modello vive nei worker (già terminati a questo punto)
+    report["peak_rss_workers_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    print(f"🧠 Picco RSS: {report['peak_rss_mb']} MB | worker: {report['peak_rss_workers_mb']} MB")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Risultati salvati in {args.output}")
+
+    if args.update_baseline:
+        failures = failed_runs(report)
+        if failures:
+            print("❌ Baseline NON aggiornato, la run contiene errori:")
+            for line in failures:
+                print(f"   • {line}")
+            return 1
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📌 Baseline aggiornato: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("ℹ️ Nessun baseline: usa --update-baseline per crearne uno")
+        return 1 if failed_runs(report) else 0
+
+    with open(args.baseline) as f:
+        regressions = compare(report, json.load(f), args.tolerance)
+    if regressions:
+        print("❌ REGRESSIONI RISPETTO AL BASELINE:")
+        for line in regressions:
+            print(f"   • {line}")
+        return 1
+    print("✅ Nessuna regressione rispetto al baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
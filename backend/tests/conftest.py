@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+
+# I test si lanciano da backend/ (python -m pytest tests) e importano il pacchetto app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import model_loader  # noqa: E402
+from .fakes import FakeBackend  # noqa: E402
+
+
+@pytest.fixture
+def fake_model():
+    # Modello "pronto" senza passare dal caricamento in background
+    backend = FakeBackend()
+    model_loader._model = backend
+    model_loader._cache.set_model_version(f"fake:{id(backend)}")
+    model_loader._set_status("ready", backend=backend.name)
+    yield backend
+    model_loader.stop_scheduler()
+    model_loader._model = None
+    model_loader._set_status("idle", backend=None)
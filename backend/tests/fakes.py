@@ -0,0 +1,48 @@
+import numpy as np
+from app import model_loader
+
+
+def pixels(value: int) -> np.ndarray:
+    # Immagine uint8 "riconoscibile": il valore dei pixel fa da identificativo nei test
+    return np.full((*model_loader.IMG_SIZE[::-1], 3), value, dtype=np.uint8)
+
+
+class FakeBackend:
+    """Backend finto senza TensorFlow: la classe predetta dipende dalla luminosità media."""
+
+    name = "fake"
+
+    def __init__(self, bright_class: int = 3, dark_class: int = 1):
+        self.bright_class = bright_class
+        self.dark_class = dark_class
+        self.batches = []
+
+    def predict(self, img_batch: np.ndarray) -> np.ndarray:
+        self.batches.append(len(img_batch))
+        out = np.full((len(img_batch), len(model_loader.CLASS_NAMES)), 0.02, dtype=np.float32)
+        for i, img in enumerate(img_batch):
+            out[i, self.bright_class if img.mean() > 0 else self.dark_class] = 0.9
+        return out
+
+
+# Caricatori per i processi di WorkerPool: funzioni di modulo, così passano a spawn
+class CrashingBackend(FakeBackend):
+    """Termina il processo quando riceve un'immagine tutta nera (pixel 0 -> -1 normalizzato)."""
+
+    def predict(self, img_batch: np.ndarray) -> np.ndarray:
+        if img_batch.min() <= -1.0 and img_batch.max() <= -1.0:
+            import os
+            os._exit(1)
+        return super().predict(img_batch)
+
+
+def load_fake_backend():
+    return FakeBackend(), {"load_ms": 0.0}
+
+
+def load_crashing_backend():
+    return CrashingBackend(), {"load_ms": 0.0}
+
+
+def load_failing_backend():
+    raise RuntimeError("Unable to open file (file signature not found)")
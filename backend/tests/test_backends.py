@@ -0,0 +1,30 @@
+from PIL import Image
+from app import backends
+
+
+def make_dataset(root, per_class=5):
+    for class_name in ("glass", "paper", "trash"):
+        (root / class_name).mkdir()
+        for i in range(per_class):
+            Image.new("RGB", (8, 8)).save(root / class_name / f"{class_name}{i}.jpg")
+    return str(root)
+
+
+def test_int8_parity_images_are_disjoint_from_calibration(tmp_path, monkeypatch):
+    dataset = make_dataset(tmp_path)
+    monkeypatch.setattr(backends, "CALIBRATION_SAMPLES", 6)
+    monkeypatch.setattr(backends, "PARITY_SAMPLES", 6)
+
+    calibration = backends.calibration_images(dataset)
+    parity = backends.parity_images("tflite_int8", dataset)
+
+    assert len(calibration) == 6 and len(parity) == 6
+    assert not set(calibration) & set(parity)
+    # Il campione resta bilanciato tra le classi
+    assert {p.split("/")[-2] for p in parity} == {"glass", "paper", "trash"}
+
+
+def test_other_backends_use_the_first_images(tmp_path, monkeypatch):
+    dataset = make_dataset(tmp_path)
+    monkeypatch.setattr(backends, "PARITY_SAMPLES", 4)
+    assert backends.parity_images("tflite_fp16", dataset) == backends.dataset_images(dataset, limit=4)
@@ -0,0 +1,74 @@
+import io
+import json
+import zipfile
+from PIL import Image
+from fastapi.testclient import TestClient
+from app import main, model_loader
+from app.main import app
+
+
+def jpeg(value: int) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 64), (value,) * 3).save(buf, "JPEG")
+    return buf.getvalue()
+
+
+def post_batch(files) -> list:
+    response = TestClient(app).post("/predict/batch", files=[("files", f) for f in files])
+    assert response.status_code == 200
+    items = [json.loads(line) for line in response.text.splitlines()]
+    return sorted(items, key=lambda item: item["index"])
+
+
+def test_batch_streams_one_line_per_image(fake_model):
+    items = post_batch([("a.jpg", jpeg(10)), ("b.jpg", jpeg(250)), ("c.heic", b"...")])
+
+    assert [item["filename"] for item in items] == ["a.jpg", "b.jpg", "c.heic"]
+    assert [item["material"] for item in items] == ["Vetro", "Carta", "Formato Errato"]
+
+
+def test_corrupt_zip_member_does_not_abort_the_stream(fake_model):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr("ok1.jpg", jpeg(10))
+        archive.writestr("rotto.jpg", jpeg(250))
+        archive.writestr("ok2.jpg", jpeg(250))
+    data = bytearray(buf.getvalue())
+    # Un byte alterato dentro il membro (memorizzato senza compressione): CRC-32 sbagliato
+    with zipfile.ZipFile(io.BytesIO(bytes(data))) as archive:
+        info = archive.getinfo("rotto.jpg")
+    data[info.header_offset + 30 + len(info.filename) + 100] ^= 0xFF
+
+    items = post_batch([("foto.zip", bytes(data)), ("d.jpg", jpeg(10))])
+
+    assert [item["filename"] for item in items] == ["ok1.jpg", "rotto.jpg", "ok2.jpg", "d.jpg"]
+    assert [item["material"] for item in items] == ["Vetro", "Archivio non valido", "Carta", "Vetro"]
+
+
+def test_invalid_zip_is_reported_as_archive_error(fake_model):
+    items = post_batch([("foto.zip", b"non uno zip")])
+    assert items[0]["material"] == "Archivio non valido"
+
+
+def test_oversized_files_are_rejected_before_reading(fake_model, monkeypatch):
+    monkeypatch.setattr(main, "BATCH_MAX_FILE_MB", 0.01)
+    big = jpeg(10) + b"\0" * 20000
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("grande.jpg", big)
+        archive.writestr("piccola.jpg", jpeg(250))
+
+    items = post_batch([("diretta.jpg", big), ("foto.zip", buf.getvalue())])
+
+    assert [item["material"] for item in items] == ["File troppo grande", "File troppo grande", "Carta"]
+
+
+def test_batch_reports_warming_up_like_predict():
+    model_loader._set_status("loading", backend=None)
+    try:
+        items = post_batch([("a.jpg", jpeg(10)), ("b.jpg", jpeg(250))])
+    finally:
+        model_loader._set_status("idle")
+
+    assert all(item["warming_up"] is True for item in items)
+    assert [item["material"] for item in items] == ["Avvio in corso", "Avvio in corso"]
@@ -0,0 +1,107 @@
+import io
+import numpy as np
+from PIL import Image
+from app import cache
+from app.cache import PredictionCache, content_key, perceptual_key
+
+RESULT = {"material": "Vetro", "bin": "VETRO", "tip": "...", "color": "#2ecc71", "confidence": 0.9}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(max_entries=10, max_bytes=1 << 20, ttl=60.0):
+    c = PredictionCache(max_entries, max_bytes, ttl)
+    c.set_model_version("v1")
+    return c
+
+
+def test_hit_returns_a_copy_and_counts():
+    c = make_cache()
+    assert c.get("a") is None
+    c.record_miss()
+    c.put(["a"], RESULT)
+
+    hit = c.get("a")
+    assert hit == RESULT
+    hit["material"] = "modificato"
+    assert c.get("a")["material"] == "Vetro"
+
+    stats = c.stats()
+    assert (stats["hits"], stats["misses"], stats["content_hits"]) == (2, 1, 2)
+    assert stats["entries"] == 1 and stats["bytes"] > 0
+
+
+def test_lru_eviction_by_entries():
+    c = make_cache(max_entries=2)
+    c.put(["a"], RESULT)
+    c.put(["b"], RESULT)
+    c.get("a")  # "a" diventa la più recente: esce "b"
+    c.put(["c"], RESULT)
+
+    assert c.get("b") is None
+    assert c.get("a") is not None and c.get("c") is not None
+    assert c.stats()["evictions"] == 1
+
+
+def test_byte_limit_evicts_and_skips_oversized_entries():
+    size = cache._entry_size("k0", RESULT)
+    c = make_cache(max_bytes=int(size * 2.5))
+    for i in range(4):
+        c.put([f"k{i}"], RESULT)
+
+    stats = c.stats()
+    assert stats["entries"] == 2 and stats["bytes"] <= c.max_bytes
+    assert c.get("k0") is None and c.get("k3") is not None
+
+    tiny = make_cache(max_bytes=size // 2)
+    tiny.put(["k0"], RESULT)
+    assert tiny.stats()["entries"] == 0
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    c = make_cache(ttl=10)
+    c.put(["a"], RESULT)
+
+    clock.now += 9
+    assert c.get("a") is not None
+    clock.now += 2
+    assert c.get("a") is None
+    assert c.stats()["expirations"] == 1 and c.stats()["entries"] == 0
+
+
+def test_new_model_version_invalidates():
+    c = make_cache()
+    c.put(["a"], RESULT)
+    c.set_model_version("v1")
+    assert c.get("a") is not None
+
+    c.set_model_version("v2")
+    assert c.get("a") is None
+    assert c.stats()["invalidations"] == 1 and c.stats()["bytes"] == 0
+
+
+def test_disabled_cache_stores_nothing():
+    c = make_cache(max_entries=0)
+    assert not c.enabled
+    c.put(["a"], RESULT)
+    assert c.get("a") is None and c.stats()["entries"] == 0
+
+
+def test_keys():
+    gradient = np.tile(np.linspace(0, 255, 224, dtype=np.uint8), (224, 1))
+    pixels = np.stack([gradient, gradient.T, gradient], axis=-1)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, "JPEG", quality=85)
+    reencoded = np.asarray(Image.open(io.BytesIO(buf.getvalue())).convert("RGB"))
+
+    assert content_key(b"abc") == content_key(b"abc") != content_key(b"abd")
+    assert perceptual_key(pixels) == perceptual_key(reencoded)
+    assert perceptual_key(pixels) != perceptual_key(pixels[:, ::-1].copy())
@@ -0,0 +1,122 @@
+import io
+import time
+import asyncio
+import numpy as np
+from PIL import Image
+from fastapi.testclient import TestClient
+from app import model_loader
+from app.live import LIVE_SMOOTHING_WINDOW, LatestFrame, ProbabilitySmoother
+from app.main import app
+
+
+def probs(index: int, confidence: float = 0.9) -> np.ndarray:
+    out = np.full(6, (1 - confidence) / 5, dtype=np.float32)
+    out[index] = confidence
+    return out
+
+
+def jpeg(value: int) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 64), (value,) * 3).save(buf, "JPEG")
+    return buf.getvalue()
+
+
+# ==========================================
+# MEDIA TEMPORALE
+# ==========================================
+def test_smoother_reports_only_stable_changes():
+    smoother = ProbabilitySmoother(window=3, min_confidence=0.5)
+    assert smoother.update(probs(1))
+    assert not smoother.update(probs(1))
+
+    # Un singolo fotogramma diverso non basta a cambiare classe
+    assert not smoother.update(probs(3))
+    assert smoother.stable_index == 1
+    assert smoother.update(probs(3))
+    assert smoother.stable_index == 3
+    np.testing.assert_allclose(smoother.smoothed, np.mean([probs(1), probs(3), probs(3)], axis=0))
+
+
+def test_smoother_ignores_low_confidence():
+    smoother = ProbabilitySmoother(window=1, min_confidence=0.5)
+    assert not smoother.update(probs(2, confidence=0.4))
+    assert smoother.stable_index is None
+
+
+# ==========================================
+# FRAME SKIPPING
+# ==========================================
+def test_latest_frame_keeps_only_newest():
+    async def scenario():
+        frames = LatestFrame()
+        frames.put(b"1")
+        frames.put(b"2")
+        frames.put(b"3")
+        assert await frames.get() == b"3"
+
+        waiter = asyncio.ensure_future(frames.get())
+        await asyncio.sleep(0)
+        frames.put(b"4")
+        assert await asyncio.wait_for(waiter, 1) == b"4"
+
+        frames.put(b"5")
+        frames.close()
+        assert await frames.get() == b"5"
+        assert await frames.get() is None
+
+    asyncio.run(scenario())
+
+
+# ==========================================
+# ENDPOINT /ws/live (backend finto, senza TensorFlow)
+# ==========================================
+def test_live_endpoint_pushes_only_on_change(fake_model):
+    client = TestClient(app)
+    with client.websocket_connect("/ws/live") as ws:
+        ws.send_bytes(jpeg(10))
+        first = ws.receive_json()
+        assert first["material"] == "Vetro"
+        assert set(first) == {"material", "bin", "tip", "color", "confidence"}
+
+        ws.send_bytes(b"non un'immagine")
+        assert ws.receive_json()["material"] == "Fotogramma non valido"
+        # Dopo l'errore la classe stabile viene reinviata
+        ws.send_bytes(jpeg(10))
+        assert ws.receive_json()["material"] == "Vetro"
+
+        # Servono più fotogrammi chiari prima che la media cambi classe (qualcuno può essere
+        # scartato se arriva mentre il modello lavora: ne inviamo abbastanza, con calma)
+        for _ in range(3 * LIVE_SMOOTHING_WINDOW):
+            ws.send_bytes(jpeg(250))
+            time.sleep(0.02)
+        changed = ws.receive_json()
+        assert changed["material"] == "Carta"
+        assert changed["confidence"] < 0.9
+
+
+def test_live_endpoint_reports_warming_up():
+    model_loader._set_status("loading", backend=None)
+    try:
+        client = TestClient(app)
+        with client.websocket_connect("/ws/live") as ws:
+            ws.send_bytes(jpeg(10))
+            message = ws.receive_json()
+            assert message["warming_up"] is True
+    finally:
+        model_loader._set_status("idle")
+
+
+
+def test_live_endpoint_reports_oversized_frame_once(fake_model, monkeypatch):
+    from app import main
+    monkeypatch.setattr(main, "LIVE_MAX_FRAME_KB", 1)
+    big = b"\xff" * 4096
+    client = TestClient(app)
+    with client.websocket_connect("/ws/live") as ws:
+        ws.send_bytes(big)
+        assert ws.receive_json()["material"] == "Fotogramma troppo grande"
+
+        # I successivi vengono scartati senza messaggi: il primo JSON è il risultato del JPEG valido
+        ws.send_bytes(big)
+        ws.send_bytes(jpeg(10))
+        assert ws.receive_json()["material"] == "Vetro"
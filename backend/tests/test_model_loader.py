@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from app import model_loader
+from .fakes import FakeBackend
+
+
+class FakeKeras(FakeBackend):
+    # Stessa firma di tf.keras.Model.predict
+    def predict(self, img_batch, verbose=0):
+        return super().predict(img_batch)
+
+
+@pytest.fixture
+def model_file(tmp_path, monkeypatch):
+    path = tmp_path / "best_model.h5"
+    path.write_bytes(b"modello")
+    monkeypatch.setattr(model_loader, "MODEL_PATH", str(path))
+    monkeypatch.setattr(model_loader, "load_keras_model", lambda: FakeKeras())
+    yield path
+    model_loader._model = None
+    model_loader._set_status("idle", backend=None, error=None)
+
+
+@pytest.mark.parametrize("error", [OSError("sola lettura"), RuntimeError("converter"), ValueError("calibrazione")])
+def test_backend_failure_falls_back_to_keras(model_file, monkeypatch, error):
+    def failing(*args):
+        raise error
+
+    monkeypatch.setattr(model_loader, "INFERENCE_BACKEND", "tflite_int8")
+    monkeypatch.setattr(model_loader, "create_backend", failing)
+    model_loader.load_local_model()
+
+    assert model_loader.is_model_ready()
+    assert model_loader.model_status()["backend"] == "keras"
+    assert model_loader._model.predict(np.zeros((1, 224, 224, 3), np.float32)).shape == (1, 6)
+
+
+def test_keras_failure_is_reported(model_file, monkeypatch):
+    def failing(*args):
+        raise OSError("file corrotto")
+
+    monkeypatch.setattr(model_loader, "INFERENCE_BACKEND", "keras")
+    monkeypatch.setattr(model_loader, "create_backend", failing)
+    model_loader.load_local_model()
+
+    assert model_loader.model_status()["state"] == "error"
+    assert model_loader._model is None
@@ -0,0 +1,46 @@
+import io
+import numpy as np
+import pytest
+from PIL import Image, ImageOps
+from app.preprocessing import EXIF_ORIENTATION_TAG, IMG_SIZE, decode
+
+
+def photo(orientation: int) -> bytes:
+    # Foto 4:3 senza simmetrie (gradienti diversi su ogni asse): un orientamento
+    # sbagliato sposta i colori e la differenza diventa enorme
+    y, x = np.mgrid[0:900, 0:1200]
+    pixels = np.stack([x * 255 // 1199, y * 255 // 899, (x + 2 * y) * 255 // 2997], axis=-1)
+    # Più un po' di dettaglio fine, come in una foto vera (è qui che draft e resize divergono)
+    pixels = np.clip(pixels * 0.8 + 25 + (25 * np.sin(x / 3.0) * np.cos(y / 5.0))[..., None], 0, 255)
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION_TAG] = orientation
+    buf = io.BytesIO()
+    Image.fromarray(pixels.astype(np.uint8)).save(buf, "JPEG", quality=90, exif=exif)
+    return buf.getvalue()
+
+
+def reference(image_bytes: bytes) -> np.ndarray:
+    # Percorso completo: decodifica a piena risoluzione, exif_transpose, resize
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes))).convert("RGB")
+    return np.asarray(img.resize(IMG_SIZE), dtype=np.float32)
+
+
+# Differenza media ammessa per canale, in unità normalizzate [-1, 1]: draft + resize sulla
+# foto piccola non danno gli stessi pixel del percorso completo (sulle foto vere ~0.065)
+TOLERANCE = 0.1
+
+
+def mean_difference(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (np.abs(a.astype(np.float32) - b) / 127.5).mean(axis=(0, 1))
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_decode_matches_exif_transpose(orientation):
+    data = photo(orientation)
+    pixels = decode(data)
+
+    assert pixels.shape == (IMG_SIZE[1], IMG_SIZE[0], 3)
+    assert (mean_difference(pixels, reference(data)) < TOLERANCE).all()
+    # Il test deve accorgersi di un orientamento sbagliato (foto 4:3, ricampionata a 224x224)
+    if orientation != 1:
+        assert (mean_difference(pixels, reference(photo(1))) > TOLERANCE).any()
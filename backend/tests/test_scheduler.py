@@ -0,0 +1,93 @@
+import threading
+import numpy as np
+import pytest
+from app.model_loader import InferenceScheduler
+from .fakes import pixels
+
+
+class RecordingBatch:
+    """run_batch finto: registra i batch ricevuti e restituisce l'id di ogni immagine."""
+
+    def __init__(self, gate: threading.Event = None):
+        self.calls = []
+        self.gate = gate
+
+    def __call__(self, images):
+        self.calls.append([int(img.flat[0]) for img in images])
+        if self.gate is not None:
+            self.gate.wait(5)
+        return np.array([[float(img.flat[0])] for img in images])
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(run_batch, **kwargs):
+        scheduler = InferenceScheduler(run_batch, **kwargs)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.stop()
+
+
+def test_concurrent_requests_share_one_batch(make_scheduler):
+    run_batch = RecordingBatch()
+    scheduler = make_scheduler(run_batch, max_batch_size=8, max_wait_ms=200)
+    futures = [scheduler.submit(pixels(i)) for i in range(5)]
+
+    assert [f.result(5)[0] for f in futures] == [0, 1, 2, 3, 4]
+    assert run_batch.calls == [[0, 1, 2, 3, 4]]
+
+
+def test_batches_never_exceed_max_size(make_scheduler):
+    run_batch = RecordingBatch()
+    scheduler = make_scheduler(run_batch, max_batch_size=4, max_wait_ms=50)
+    futures = [scheduler.submit(pixels(i)) for i in range(10)]
+
+    assert [f.result(5)[0] for f in futures] == list(range(10))
+    assert all(len(call) <= 4 for call in run_batch.calls)
+    assert sorted(sum(run_batch.calls, [])) == list(range(10))
+
+
+def test_cancelled_requests_are_skipped(make_scheduler):
+    gate = threading.Event()
+    run_batch = RecordingBatch(gate)
+    scheduler = make_scheduler(run_batch, max_batch_size=8, max_wait_ms=0)
+
+    # Il primo batch resta bloccato nel modello mentre gli altri aspettano in coda
+    first = scheduler.submit(pixels(1))
+    while not run_batch.calls:
+        threading.Event().wait(0.005)
+    cancelled = scheduler.submit(pixels(2))
+    kept = scheduler.submit(pixels(3))
+    assert cancelled.cancel()
+    gate.set()
+
+    assert first.result(5)[0] == 1
+    assert kept.result(5)[0] == 3
+    assert 2 not in sum(run_batch.calls, [])
+
+
+def test_batch_error_reaches_every_caller(make_scheduler):
+    def failing(images):
+        raise RuntimeError("boom")
+
+    scheduler = make_scheduler(failing, max_batch_size=8, max_wait_ms=100)
+    futures = [scheduler.submit(pixels(i)) for i in range(3)]
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match="boom"):
+            future.result(5)
+
+
+def test_stop_joins_threads_and_submit_restarts(make_scheduler):
+    run_batch = RecordingBatch()
+    scheduler = make_scheduler(run_batch, max_batch_size=2, max_wait_ms=0, num_threads=3)
+    scheduler.start()
+    scheduler.stop()
+    assert scheduler._threads == []
+
+    assert scheduler.submit(pixels(7)).result(5)[0] == 7
@@ -0,0 +1,79 @@
+import time
+import pytest
+from app import workers
+from app.workers import WorkerCrashed, WorkerPool
+from .fakes import load_crashing_backend, load_failing_backend, load_fake_backend, pixels
+
+IMG_SIZE = (224, 224)
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(load_backend, num_workers=1, acquire_timeout=5.0):
+        pool = WorkerPool(num_workers, 4, IMG_SIZE, acquire_timeout, load_backend=load_backend)
+        pools.append(pool)
+        pool.start()
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.stop()
+
+
+def wait_until(condition, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condizione non raggiunta in tempo"
+        time.sleep(0.05)
+
+
+def test_batches_run_in_worker_processes(make_pool):
+    pool = make_pool(load_fake_backend, num_workers=2)
+    assert pool.wait_ready(30)
+    assert pool.is_ready() and pool.backend == "fake"
+
+    probs = pool.run_batch([pixels(10), pixels(250)])
+    assert probs.shape == (2, 6)
+    assert list(probs.argmax(axis=1)) == [1, 3]
+
+
+def test_load_failure_is_reported_and_not_restarted(make_pool):
+    pool = make_pool(load_failing_backend, acquire_timeout=0.2)
+
+    assert not pool.wait_ready(30)
+    assert not pool.is_ready()
+    assert "file signature" in pool.error
+    assert pool.stats()[0]["restarts"] == 0
+
+    # Nessun worker disponibile: il batch fallisce dopo il timeout invece di bloccarsi
+    with pytest.raises(WorkerCrashed):
+        pool.run_batch([pixels(10)])
+
+
+def test_crashed_worker_is_restarted(make_pool, monkeypatch):
+    monkeypatch.setattr(workers, "RESTART_DELAY_S", 0.05)
+    pool = make_pool(load_crashing_backend)
+    assert pool.wait_ready(30)
+
+    with pytest.raises(WorkerCrashed):
+        pool.run_batch([pixels(0)])
+
+    wait_until(lambda: pool.stats()[0]["restarts"] == 1 and pool.is_ready())
+    assert pool.run_batch([pixels(250)]).argmax() == 3
+
+
+def test_readiness_follows_the_pool(make_pool, monkeypatch):
+    from app import model_loader
+
+    pool = make_pool(load_failing_backend)
+    pool.wait_ready(30)
+    monkeypatch.setattr(model_loader, "_pool", pool)
+    model_loader._set_status("ready", backend="keras")
+    try:
+        assert not model_loader.is_model_ready()
+        status = model_loader.model_status()
+        assert status["state"] == "workers_down" and status["workers_ready"] == 0
+    finally:
+        model_loader._set_status("idle", backend=None)